@@ -0,0 +1,236 @@
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, g, request
+
+# cheap page views, searches and writes each get their own buckets and slots,
+# so a burst of searches or form posts can't use up what the page views need
+READ, SEARCH, WRITE = "read", "search", "write"
+
+SEARCH_ENDPOINTS = {"search", "search_venues", "search_artists"}
+
+DEFAULT_LIMITS = {
+    READ: {"rate": 20, "burst": 40, "concurrency": 32, "queue_timeout": 0.5},
+    SEARCH: {"rate": 2, "burst": 6, "concurrency": 4, "queue_timeout": 0.25},
+    WRITE: {"rate": 1, "burst": 5, "concurrency": 4, "queue_timeout": 0.25},
+}
+
+
+class MemoryBuckets:
+    """Token buckets kept in this process, one per (client, class)."""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        # returns 0 when the request may go ahead, else the seconds until it could
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp, _, _ = self._buckets.get(key, (burst, now, rate, burst))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now, rate, burst)
+                return 0.0
+            self._buckets[key] = (tokens, now, rate, burst)
+            if len(self._buckets) > self.max_entries:
+                self._prune(now)
+            return (cost - tokens) / rate
+
+    def _prune(self, now):
+        # a bucket that has refilled completely is the same as no bucket. each refills at its
+        # own class's rate, kept with it
+        full = [
+            key
+            for key, (tokens, stamp, rate, burst) in self._buckets.items()
+            if tokens + (now - stamp) * rate >= burst
+        ]
+        for key in full:
+            del self._buckets[key]
+
+
+# refill and take in one round trip, so concurrent workers can't both spend the last token
+_TAKE_SCRIPT = """
+local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 't', 's')
+local tokens, stamp = tonumber(state[1]) or burst, tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tokens, 's', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker, so the limit holds per client and not per process."""
+
+    def __init__(self, url, prefix="fyyur:admission:"):
+        # optional dependency, only needed when ADMISSION_STORE points at redis
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost=1):
+        return float(self._take(keys=[self.prefix + key], args=[rate, burst, time.time(), cost]))
+
+
+class _Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.waited = defaultdict(float)
+
+    def count(self, cls, name, amount=1):
+        with self._lock:
+            self.counters[cls][name] += amount
+
+    def wait(self, cls, seconds):
+        with self._lock:
+            self.waited[cls] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {cls: dict(values) for cls, values in self.counters.items()}, dict(self.waited)
+
+
+class Admission:
+    """Per client rate limits and per class and per route concurrency limits in front of every request.
+
+    Requests are sorted into read, search and write classes. Each class has a
+    token bucket per client (ADMISSION_LIMITS rate/burst, 429 when empty) and a
+    fixed number of slots per process (concurrency). Endpoints listed in
+    ADMISSION_ROUTE_LIMITS also need one of their own slots, so a slow route
+    can't fill its class's. A request that finds no free slot waits up to
+    queue_timeout for one and then gets a 503. Buckets live in the process
+    unless ADMISSION_STORE is a redis:// url; slots are always per process.
+
+    Clients are told apart by request.remote_addr. Behind a reverse proxy
+    that is the proxy's address unless the app trusts its X-Forwarded-For
+    (TRUSTED_PROXIES), or every client shares one bucket.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("ADMISSION_ENABLED", False)
+        self.exempt = {None, "static", "admission_stats"}
+        self.exempt.update(app.config.get("ADMISSION_EXEMPT", ()))
+        self.limits = {cls: dict(limits) for cls, limits in DEFAULT_LIMITS.items()}
+        for cls, limits in app.config.get("ADMISSION_LIMITS", {}).items():
+            self.limits[cls].update(limits)
+        store = app.config.get("ADMISSION_STORE", "memory")
+        self.buckets = MemoryBuckets() if store == "memory" else RedisBuckets(store)
+        self.slots = {
+            cls: threading.BoundedSemaphore(limits["concurrency"]) for cls, limits in self.limits.items()
+        }
+        # endpoint -> {"concurrency", "queue_timeout"}, taken on top of the class's slot
+        self.route_limits = {
+            endpoint: {"queue_timeout": 0.25, **limits}
+            for endpoint, limits in app.config.get("ADMISSION_ROUTE_LIMITS", {}).items()
+        }
+        self.route_slots = {
+            endpoint: threading.BoundedSemaphore(limits["concurrency"])
+            for endpoint, limits in self.route_limits.items()
+        }
+        self.metrics = _Metrics()
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+
+    def classify(self):
+        if request.endpoint in SEARCH_ENDPOINTS:
+            return SEARCH
+        if request.method in ("GET", "HEAD", "OPTIONS"):
+            return READ
+        return WRITE
+
+    def _reject(self, cls, status, retry_after, reason):
+        self.metrics.count(cls, "rejected_%d" % status)
+        response = Response(reason + "\n", status, mimetype="text/plain")
+        response.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+        return response
+
+    def _admit(self):
+        if not self.enabled or request.endpoint in self.exempt:
+            return None
+        cls = self.classify()
+        limits = self.limits[cls]
+        retry_after = self.buckets.take(f"{cls}:{request.remote_addr}", limits["rate"], limits["burst"])
+        if retry_after:
+            return self._reject(cls, 429, retry_after, "Too many requests, slow down.")
+        if not self._acquire(cls, self.slots[cls], limits["queue_timeout"]):
+            return self._reject(cls, 503, limits["queue_timeout"], "Server busy, try again shortly.")
+        route = request.endpoint if request.endpoint in self.route_slots else None
+        if route:
+            timeout = self.route_limits[route]["queue_timeout"]
+            if not self._acquire(route, self.route_slots[route], timeout):
+                self.slots[cls].release()
+                self.metrics.count(route, "rejected_503")
+                return self._reject(cls, 503, timeout, "Server busy, try again shortly.")
+            g.admission_route = route
+            self.metrics.count(route, "admitted")
+        g.admission_class = cls
+        self.metrics.count(cls, "admitted")
+        self.metrics.count(cls, "in_flight")
+        return None
+
+    def _acquire(self, name, slot, timeout):
+        # takes a free slot, or waits up to timeout for one, counting the wait under name
+        if slot.acquire(blocking=False):
+            return True
+        self.metrics.count(name, "queued")
+        started = time.perf_counter()
+        acquired = slot.acquire(timeout=timeout)
+        self.metrics.wait(name, time.perf_counter() - started)
+        return acquired
+
+    def _release(self, exc=None):
+        route = g.pop("admission_route", None)
+        if route is not None:
+            self.route_slots[route].release()
+        cls = g.pop("admission_class", None)
+        if cls is None:
+            return
+        self.metrics.count(cls, "in_flight", -1)
+        self.slots[cls].release()
+
+    def stats(self):
+        counters, waited = self.metrics.snapshot()
+        result = {}
+        for cls, limits in self.limits.items():
+            values = counters.get(cls, {})
+            queued = values.get("queued", 0)
+            result[cls] = {
+                "limits": limits,
+                "in_flight": values.get("in_flight", 0),
+                "admitted": values.get("admitted", 0),
+                "queued": queued,
+                "avg_queue_ms": round(waited.get(cls, 0.0) / queued * 1000, 3) if queued else 0.0,
+                "rejected_429": values.get("rejected_429", 0),
+                "rejected_503": values.get("rejected_503", 0),
+            }
+        routes = {}
+        for endpoint, limits in self.route_limits.items():
+            values = counters.get(endpoint, {})
+            queued = values.get("queued", 0)
+            routes[endpoint] = {
+                "limits": limits,
+                "admitted": values.get("admitted", 0),
+                "queued": queued,
+                "avg_queue_ms": round(waited.get(endpoint, 0.0) / queued * 1000, 3) if queued else 0.0,
+                "rejected_503": values.get("rejected_503", 0),
+            }
+        return {
+            "enabled": self.enabled,
+            "store": type(self.buckets).__name__,
+            "classes": result,
+            "routes": routes,
+        }
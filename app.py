@@ -2,18 +2,39 @@
 # Imports
 # ----------------------------------------------------------------------------#
 
+import csv
 import json
+import os
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, stream_with_context, send_file, abort
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from jinja2 import FileSystemBytecodeCache
+from storage import SQLAlchemyStorage
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
 import datetime
+import functools
+import hashlib
+import click
+from name_index import PrefixIndex
+from cache import cache_from_config
+from profiling import RequestProfiler
+from admission import Admission
+from query_budget import query_budget
+from recommend import FeatureSpace, top_k_cosine, pair_scores, history_matrix, normalize_rows
+from scipy import sparse
+import feeds
+import export
+import live
+import geo
+import outbox
+import static_site
+from images import ImageStore, FORMATS as IMAGE_FORMATS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 # ----------------------------------------------------------------------------#
 # App Config.
@@ -22,10 +43,19 @@ import datetime
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object("config")
-db = SQLAlchemy(app)
+# postgres, or a sqlite file with a writer connection and a pool of readers
+db = SQLAlchemyStorage(app)
 
 # TODO: connect to a local postgresql database
-Migrate(app, db)
+# sqlite can't alter tables in place, batch mode has alembic copy them instead
+Migrate(app, db, render_as_batch=app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"))
+# off unless PROFILE_ENABLED, PROFILE_SAMPLE_RATE or a signed X-Profile header asks for it
+RequestProfiler(app)
+# behind a reverse proxy remote_addr is the proxy's, trust that many hops of X-Forwarded-For instead
+if app.config["TRUSTED_PROXIES"]:
+	app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+# token buckets per client and concurrency slots per route class and per listed route, see ADMISSION_LIMITS
+admission = Admission(app)
 # ----------------------------------------------------------------------------#
 # Models.
 # ----------------------------------------------------------------------------#
@@ -47,6 +77,17 @@ class Venue(db.Model):
 	website = db.Column(db.String(120))
 	seeking_talent = db.Column(db.Boolean, default=False)
 	seeking_description = db.Column(db.String())
+	# lets incremental exports pick up edited rows, not just new ones
+	updated_at = db.Column(
+		db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now, index=True
+	)
+	# optimistic locking, an edit only applies to the version the editor loaded
+	version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+	# from the geocode table, see locate_venues. geohash is the grid cell /venues/nearby searches by
+	latitude = db.Column(db.Float)
+	longitude = db.Column(db.Float)
+	geohash = db.Column(db.String(12), index=True)
+	__table_args__ = (db.Index("ix_venue_state_city", "state", "city"),)
 
 	def __repr__(self):
 		return f"<Venue {self.id} {self.name} {self.city} {self.state} {self.address} {self.phone} {self.genres}>"
@@ -68,6 +109,10 @@ class Artist(db.Model):
 	website = db.Column(db.String(120))
 	seeking_venue = db.Column(db.Boolean, default=False)
 	seeking_description = db.Column(db.String())
+	updated_at = db.Column(
+		db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now, index=True
+	)
+	version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 	# it seems that this line is unnessesary as it's not detected in migration
 	venues = db.relationship("Venue", secondary="show", backref="artists")
 
@@ -83,6 +128,16 @@ class Show(db.Model):
 	start_time = db.Column(db.DateTime, nullable=False)
 	artist_id = db.Column(db.Integer, db.ForeignKey("Artist.id"), nullable=False)
 	venue_id = db.Column(db.Integer, db.ForeignKey("Venue.id"), nullable=False)
+	updated_at = db.Column(
+		db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now, index=True
+	)
+	# composite indexes for the /shows filters, date range first then narrowed by venue or artist
+	__table_args__ = (
+		db.Index("ix_show_start_time_venue_id", "start_time", "venue_id"),
+		db.Index("ix_show_start_time_artist_id", "start_time", "artist_id"),
+		db.Index("ix_show_venue_id_start_time", "venue_id", "start_time"),
+		db.Index("ix_show_artist_id_start_time", "artist_id", "start_time"),
+	)
 	artist = db.relationship(
 		"Artist", backref=db.backref("show", cascade="all, delete")
 	)
@@ -97,12 +152,15 @@ artist_genre = db.Table(
 	"artist_genre",
 	db.Column("artist_id", db.Integer, db.ForeignKey("Artist.id"), primary_key=True),
 	db.Column("genre_id", db.Integer, db.ForeignKey("genre.id"), primary_key=True),
+	# the primary key covers lookups by artist, this one covers lookups by genre
+	db.Index("ix_artist_genre_genre_id", "genre_id", "artist_id"),
 )
 
 venue_genre = db.Table(
 	"venue_genre",
 	db.Column("venue_id", db.Integer, db.ForeignKey("Venue.id"), primary_key=True),
 	db.Column("genre_id", db.Integer, db.ForeignKey("genre.id"), primary_key=True),
+	db.Index("ix_venue_genre_genre_id", "genre_id", "venue_id"),
 )
 
 # genre table. 1NF(first normal form) wouldnot allow multi argument per column of each row
@@ -129,6 +187,129 @@ class Genre(db.Model):
 		return f"<Genre {self.id}, {self.name} >"
 
 
+# top-k neighbours per artist, rank 0 is the closest. refreshed by refresh_similar_artists
+class SimilarArtist(db.Model):
+	__tablename__ = "similar_artist"
+
+	artist_id = db.Column(
+		db.Integer, db.ForeignKey("Artist.id", ondelete="CASCADE"), primary_key=True
+	)
+	rank = db.Column(db.Integer, primary_key=True)
+	similar_id = db.Column(
+		db.Integer, db.ForeignKey("Artist.id", ondelete="CASCADE"), nullable=False
+	)
+	score = db.Column(db.Float, nullable=False)
+
+	def __repr__(self):
+		return f"<SimilarArtist {self.artist_id} #{self.rank} {self.similar_id} {self.score}>"
+
+
+# seeking venue x seeking artist pairs scoring at least MATCH_MIN_SCORE, see refresh_matches
+class TalentMatch(db.Model):
+	__tablename__ = "talent_match"
+
+	venue_id = db.Column(
+		db.Integer, db.ForeignKey("Venue.id", ondelete="CASCADE"), primary_key=True
+	)
+	artist_id = db.Column(
+		db.Integer, db.ForeignKey("Artist.id", ondelete="CASCADE"), primary_key=True
+	)
+	score = db.Column(db.Float, nullable=False)
+	__table_args__ = (
+		db.Index("ix_talent_match_venue_id_score", "venue_id", "score"),
+		db.Index("ix_talent_match_artist_id_score", "artist_id", "score"),
+	)
+
+	def __repr__(self):
+		return f"<TalentMatch venue {self.venue_id} artist {self.artist_id} {self.score}>"
+
+
+# shows per month along one dimension, "venue", "artist" or "genre", keyed by that entity's id
+# kept up to date by the write handlers so reports never scan the show table. names and a
+# venue's city are joined in when reporting, so renaming or moving something leaves these alone
+class AnalyticsRollup(db.Model):
+	__tablename__ = "analytics_rollup"
+
+	dimension = db.Column(db.String(16), primary_key=True)
+	key = db.Column(db.String(255), primary_key=True)
+	month = db.Column(db.String(7), primary_key=True)
+	shows = db.Column(db.Integer, nullable=False, default=0)
+	__table_args__ = (db.Index("ix_analytics_rollup_dimension_month", "dimension", "month"),)
+
+	def __repr__(self):
+		return f"<AnalyticsRollup {self.dimension} {self.key} {self.month} {self.shows}>"
+
+
+# render-ready venue/artist documents, rebuilt in the same transaction as the rows they come from
+class ReadModel(db.Model):
+	__tablename__ = "read_model"
+
+	entity = db.Column(db.String(16), primary_key=True)
+	entity_id = db.Column(db.Integer, primary_key=True)
+	document = db.Column(db.Text, nullable=False)
+	updated_at = db.Column(
+		db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now
+	)
+
+	def __repr__(self):
+		return f"<ReadModel {self.entity} {self.entity_id}>"
+
+
+# local geocoding: coordinates per street address, and per city under an empty address.
+# names are stored lower case, filled by `flask import-geocodes`
+class Geocode(db.Model):
+	__tablename__ = "geocode"
+
+	state = db.Column(db.String(120), primary_key=True)
+	city = db.Column(db.String(120), primary_key=True)
+	address = db.Column(db.String(120), primary_key=True, default="")
+	latitude = db.Column(db.Float, nullable=False)
+	longitude = db.Column(db.Float, nullable=False)
+
+	def __repr__(self):
+		return f"<Geocode {self.address}, {self.city}, {self.state} {self.latitude} {self.longitude}>"
+
+
+# every change to venues, artists, shows and their genres, written in the transaction that makes it
+class OutboxEvent(db.Model):
+	__tablename__ = "outbox_event"
+	# without AUTOINCREMENT sqlite hands out ids again once prune() emptied the table, behind every checkpoint
+	__table_args__ = {"sqlite_autoincrement": True}
+
+	id = db.Column(db.Integer, primary_key=True)
+	entity = db.Column(db.String(16), nullable=False)
+	# null for a bulk change, consumers rescan the entity
+	entity_id = db.Column(db.Integer)
+	op = db.Column(db.String(16), nullable=False)
+	changes = db.Column(db.Text, nullable=False)
+	created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+
+	def __repr__(self):
+		return f"<OutboxEvent {self.id} {self.op} {self.entity} {self.entity_id}>"
+
+
+# how far each outbox consumer got
+class OutboxCheckpoint(db.Model):
+	__tablename__ = "outbox_checkpoint"
+
+	consumer = db.Column(db.String(64), primary_key=True)
+	position = db.Column(db.Integer, nullable=False, default=0)
+	updated_at = db.Column(db.DateTime, default=datetime.datetime.now)
+
+	def __repr__(self):
+		return f"<OutboxCheckpoint {self.consumer} {self.position}>"
+
+
+# keeps the grid cell in step with coordinates set through the orm
+@db.event.listens_for(Venue, "before_insert")
+@db.event.listens_for(Venue, "before_update")
+def set_venue_geohash(mapper, connection, venue):
+	if venue.latitude is None or venue.longitude is None:
+		venue.geohash = None
+	else:
+		venue.geohash = geo.encode(venue.latitude, venue.longitude)
+
+
 """ # inserting initial values into the genre table by detecting event after creation of table
 @db.event.listens_for(Genre.__table__, 'after_create')
 def insert_initial_values(*args, **kwargs):
@@ -165,8 +346,14 @@ def insert_initial_values(*args, **kwargs):
 # ----------------------------------------------------------------------------#
 
 
+# the same few start times come up on every page view, and parsing plus babel is most of a tile
+@functools.lru_cache(maxsize=4096)
 def format_datetime(value, format="medium"):
-	date = dateutil.parser.parse(value)
+	try:
+		# str(datetime), what the payloads carry, without dateutil's guessing
+		date = datetime.datetime.fromisoformat(value)
+	except ValueError:
+		date = dateutil.parser.parse(value)
 	if format == "full":
 		format = "EEEE MMMM, d, y 'at' h:mma"
 	elif format == "medium":
@@ -211,14 +398,685 @@ def show_times(entity):
 	return (past_shows, up_coming_shows)
 
 
+# number of upcoming shows per venue or artist id, one grouped query for the whole list
+# column is Show.venue_id or Show.artist_id
+def upcoming_show_counts(column, ids):
+	if not ids:
+		return {}
+	rows = (
+		db.session.query(column, db.func.count(Show.id))
+		.filter(column.in_(ids), Show.start_time >= datetime.datetime.now())
+		.group_by(column)
+	)
+	return dict(rows.all())
+
+
+# parses a date or datetime from the query string, a bare date as "end" covers that whole day
+def parse_filter_date(value, end=False):
+	if not value:
+		return None
+	try:
+		date = dateutil.parser.parse(value)
+	except (ValueError, OverflowError):
+		return None
+	if end and len(value) <= 10:
+		date += datetime.timedelta(days=1)
+	return date
+
+
+# shows joined with their venue and artist in one query, narrowed by the /shows filter parameters
+# start/end (date range), venue_id, artist_id, city, state and genre (of the artist)
+# one row per show with the columns a show tile needs
+def show_rows():
+	return (
+		db.session.query(
+			Show.id,
+			Show.start_time,
+			Show.venue_id,
+			Venue.name.label("venue_name"),
+			Venue.city,
+			Venue.state,
+			Show.artist_id,
+			Artist.name.label("artist_name"),
+			Artist.image_link.label("artist_image_link"),
+		)
+		.join(Venue, Show.venue_id == Venue.id)
+		.join(Artist, Show.artist_id == Artist.id)
+	)
+
+
+def filtered_shows(args):
+	query = show_rows()
+	start = parse_filter_date(args.get("start"))
+	if start:
+		query = query.filter(Show.start_time >= start)
+	end = parse_filter_date(args.get("end"), end=True)
+	if end:
+		query = query.filter(Show.start_time < end)
+	if args.get("venue_id", type=int):
+		query = query.filter(Show.venue_id == args.get("venue_id", type=int))
+	if args.get("artist_id", type=int):
+		query = query.filter(Show.artist_id == args.get("artist_id", type=int))
+	if args.get("state"):
+		query = query.filter(Venue.state == args["state"].upper())
+	if args.get("city"):
+		query = query.filter(db.func.lower(Venue.city) == args["city"].strip().lower())
+	if args.get("genre"):
+		query = query.filter(
+			db.session.query(artist_genre)
+			.join(Genre, Genre.id == artist_genre.c.genre_id)
+			.filter(artist_genre.c.artist_id == Show.artist_id, Genre.name == args["genre"])
+			.exists()
+		)
+	return query.order_by(Show.start_time)
+
+
 app.jinja_env.filters["datetime"] = format_datetime
 
+# resized copies of the remote image_link pictures, see /thumbs below
+image_store = ImageStore(
+	app.config.get("IMAGE_CACHE_DIR", "image-cache"),
+	source_dir=app.config.get("IMAGE_SOURCE_DIR"),
+	allowed_origins=app.config.get("IMAGE_ALLOWED_ORIGINS", ()),
+	widths=app.config.get("IMAGE_WIDTHS", (400, 800)),
+)
+
+
+def thumbnail_url(url, width=400, fmt=None):
+	# url of a thumbnail at least width pixels wide, or the original when we can't make one
+	# fmt defaults to webp for browsers that take it
+	if not url or not image_store.available:
+		return url
+	# other hosts only once `flask ingest-images` has picked them up from IMAGE_SOURCE_DIR
+	if not (image_store.allowed(url) or image_store.digest(url, fetch=False)):
+		return url
+	widths = [w for w in image_store.widths if w >= width] or [max(image_store.widths)]
+	if fmt is None:
+		fmt = "webp" if "image/webp" in request.accept_mimetypes else "jpeg"
+	return url_for("thumbnail", width=min(widths), fmt=fmt, src=url)
+
+
+app.jinja_env.filters["thumb"] = thumbnail_url
+
+
+# show dicts plus what the tile macros in partials/tiles.html print, so the templates only
+# output fields. partner is the side a tile links to: the artist on /shows and venue pages,
+# the venue on artist pages. each distinct image is looked up once
+def show_tiles(shows, partner="artist"):
+	images = {}
+	tiles = []
+	for show in shows:
+		url = show[f"{partner}_image_link"]
+		if url not in images:
+			images[url] = thumbnail_url(url)
+		tiles.append(
+			dict(
+				show,
+				image=images[url],
+				when=format_datetime(show["start_time"], "full"),
+				href=f"/{partner}s/{show[partner + '_id']}",
+				name=show[f"{partner}_name"],
+			)
+		)
+	return tiles
+
+
+# a copy of a cached venue or artist payload with its show lists made into tiles
+def detail_tiles(payload, partner):
+	if "upcoming_shows" not in payload:
+		return payload
+	return dict(
+		payload,
+		upcoming_shows=show_tiles(payload["upcoming_shows"], partner),
+		past_shows=show_tiles(payload["past_shows"], partner),
+	)
+
+
+# makes its directory on the first template it stores, importing the app doesn't touch the disk
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+	def dump_bytecode(self, bucket):
+		os.makedirs(self.directory, exist_ok=True)
+		super().dump_bytecode(bucket)
+
+
+# compiled templates are kept on disk, so a restarted worker doesn't compile them again
+if app.config.get("TEMPLATE_CACHE_DIR"):
+	app.jinja_env.bytecode_cache = TemplateBytecodeCache(app.config["TEMPLATE_CACHE_DIR"])
+
+
+def precompile_templates():
+	# loads every template once, which compiles it into the bytecode cache
+	names = app.jinja_env.list_templates(extensions=["html"])
+	for name in names:
+		app.jinja_env.get_template(name)
+	return names
+
+# pushes created, updated and cancelled shows to /shows/stream, see live.py
+broadcaster = live.Broadcaster(app.config.get("LIVE_QUEUE_SIZE", 100))
+live_shows = live.LiveShows(db, broadcaster)
+
+# change data capture for downstream indexes, see outbox.py and `flask outbox-consume`
+change_outbox = outbox.Outbox(db, OutboxEvent, OutboxCheckpoint, settle=app.config.get("OUTBOX_SETTLE", 300))
+change_outbox.track(Venue, "venue")
+change_outbox.track(Artist, "artist")
+change_outbox.track(Show, "show")
+change_outbox.track_link("venue_genre", Venue, "genres", Genre, "venues")
+change_outbox.track_link("artist_genre", Artist, "genres", Genre, "artists")
+
+
+# upcoming shows as stream events, with everything the /shows filters and tiles need
+# takes show_ids, venue_id or artist_id. call it before the shows are deleted
+def show_events(show_ids=None, venue_id=None, artist_id=None):
+	query = show_rows().filter(Show.start_time >= datetime.datetime.now())
+	if show_ids is not None:
+		query = query.filter(Show.id.in_(show_ids))
+	if venue_id is not None:
+		query = query.filter(Show.venue_id == venue_id)
+	if artist_id is not None:
+		query = query.filter(Show.artist_id == artist_id)
+	rows = query.all()
+	genres = {}
+	if rows:
+		pairs = (
+			db.session.query(artist_genre.c.artist_id, Genre.name)
+			.join(Genre, Genre.id == artist_genre.c.genre_id)
+			.filter(artist_genre.c.artist_id.in_({r.artist_id for r in rows}))
+		)
+		for artist, name in pairs:
+			genres.setdefault(artist, []).append(name)
+	return [
+		{
+			"id": r.id,
+			"start_time": r.start_time.isoformat(),
+			"start_time_label": format_datetime(str(r.start_time), "full"),
+			"venue_id": r.venue_id,
+			"venue_name": r.venue_name,
+			"city": r.city,
+			"state": r.state,
+			"artist_id": r.artist_id,
+			"artist_name": r.artist_name,
+			# kiosks share one payload, jpeg works in all of them
+			"artist_image_link": thumbnail_url(r.artist_image_link, fmt="jpeg"),
+			"genres": genres.get(r.artist_id, []),
+		}
+		for r in rows
+	]
+
+# in-memory prefix indexes of venue and artist names for the autocomplete endpoint
+# built once on the first request then kept up to date by the create/edit/delete handlers
+venue_index = PrefixIndex()
+artist_index = PrefixIndex()
+
+
+# memoized show_venue / show_artist payloads, keyed "venue:<id>" and "artist:<id>"
+detail_cache = cache_from_config(app.config)
+
+
+# read model documents. everything a detail page needs, precomputed and stored as json
+# the past/upcoming split depends on the clock so the document keeps one "shows" list
+def venue_document(venue_id):
+	v = Venue.query.get(venue_id)
+	if not v:
+		return None
+	shows = (
+		Show.query.options(db.joinedload(Show.artist))
+		.filter(Show.venue_id == venue_id)
+		.order_by(Show.start_time)
+		.all()
+	)
+	return {
+		"id": v.id,
+		"name": v.name,
+		"genres": [g.name for g in v.genres],
+		"address": v.address,
+		"city": v.city,
+		"state": v.state,
+		"phone": v.phone,
+		"website": v.website,
+		"facebook_link": v.facebook_link,
+		"seeking_talent": v.seeking_talent,
+		"seeking_description": v.seeking_description,
+		"image_link": v.image_link,
+		"shows": show_response_format_4_venue(shows),
+	}
+
+
+def artist_document(artist_id):
+	a = Artist.query.get(artist_id)
+	if not a:
+		return None
+	shows = (
+		Show.query.options(db.joinedload(Show.venue))
+		.filter(Show.artist_id == artist_id)
+		.order_by(Show.start_time)
+		.all()
+	)
+	return {
+		"id": a.id,
+		"name": a.name,
+		"genres": [g.name for g in a.genres],
+		"city": a.city,
+		"state": a.state,
+		"phone": a.phone,
+		"website": a.website,
+		"facebook_link": a.facebook_link,
+		"seeking_venue": a.seeking_venue,
+		"seeking_description": a.seeking_description,
+		"image_link": a.image_link,
+		"shows": show_response_format_4_artist(shows),
+	}
+
+
+document_builders = {"venue": venue_document, "artist": artist_document}
+
+
+# rewrites the documents inside the caller's transaction, so they commit (or roll back) with the change
+def refresh_documents(venue_ids=(), artist_ids=()):
+	db.session.flush()
+	for entity, ids in (("venue", venue_ids), ("artist", artist_ids)):
+		for entity_id in ids:
+			document = document_builders[entity](entity_id)
+			row = ReadModel.query.get((entity, entity_id))
+			if document is None:
+				if row:
+					db.session.delete(row)
+			elif row:
+				row.document = json.dumps(document)
+			else:
+				db.session.add(ReadModel(entity=entity, entity_id=entity_id, document=json.dumps(document)))
+
+
+def split_shows(document):
+	now = datetime.datetime.now()
+	payload = dict(document)
+	shows = payload.pop("shows")
+	past_shows = [s for s in shows if datetime.datetime.fromisoformat(s["start_time"]) < now]
+	upcoming_shows = [s for s in shows if datetime.datetime.fromisoformat(s["start_time"]) >= now]
+	payload.update(
+		past_shows=past_shows,
+		upcoming_shows=upcoming_shows,
+		past_shows_count=len(past_shows),
+		upcoming_shows_count=len(upcoming_shows),
+	)
+	return payload
+
+
+# one primary key lookup, falls back to the live joins if the document wasn't built yet
+def detail_payload(entity, entity_id):
+	row = ReadModel.query.get((entity, entity_id))
+	document = json.loads(row.document) if row else document_builders[entity](entity_id)
+	return split_shows(document) if document else None
+
+
+def venue_payload(venue_id):
+	return detail_payload("venue", venue_id)
+
+
+def artist_payload(artist_id):
+	return detail_payload("artist", artist_id)
+
+
+class EditConflict(Exception):
+	# someone else saved the venue or artist after the editor loaded it
+	pass
+
+
+# one UPDATE that only matches the row when at least one of fields differs from what's stored
+# and, given the version the editor loaded, when the row is still at that version
+# returns whether anything changed, without loading the row first. only a no-op edit
+# costs a second query, to tell "nothing changed" apart from EditConflict
+def update_if_changed(model, entity_id, fields, version=None):
+	table = model.__table__
+	unchanged = db.and_(*[table.c[name].isnot_distinct_from(value) for name, value in fields.items()])
+	match = db.and_(table.c.id == entity_id, db.not_(unchanged))
+	if version is not None:
+		match = db.and_(match, table.c.version == version)
+	result = db.session.execute(
+		table.update().where(match).values(version=table.c.version + 1, **fields)
+	)
+	if result.rowcount:
+		# a core statement, the outbox's session events don't see it
+		change_outbox.record(change_outbox.entities[model], "update", entity_id, fields)
+		return True
+	if version is not None:
+		current = db.session.query(table.c.version).filter(table.c.id == entity_id).scalar()
+		if current != version:
+			raise EditConflict(current)
+	return False
+
+
+# new version for a change that lives outside the row, like its genres
+def bump_version(model, entity_id, version=None):
+	table = model.__table__
+	match = table.c.id == entity_id
+	if version is not None:
+		match = db.and_(match, table.c.version == version)
+	result = db.session.execute(table.update().where(match).values(version=table.c.version + 1))
+	if not result.rowcount:
+		raise EditConflict()
+	change_outbox.record(change_outbox.entities[model], "update", entity_id, {})
+
+
+# sets an entity's genres to names by deleting and inserting only the difference,
+# one statement each. table is artist_genre or venue_genre, column its entity id column.
+# returns the added and removed genre ids
+def sync_genres(table, column, entity_id, names):
+	current = {r[0] for r in db.session.query(table.c.genre_id).filter(column == entity_id)}
+	wanted = set()
+	if names:
+		wanted = {r[0] for r in db.session.query(Genre.id).filter(Genre.name.in_(names))}
+	removed, added = current - wanted, wanted - current
+	if removed:
+		db.session.execute(
+			table.delete().where(db.and_(column == entity_id, table.c.genre_id.in_(removed)))
+		)
+	# one multi-row INSERT ... VALUES, not an executemany of single row inserts
+	if added:
+		db.session.execute(
+			table.insert().values([{column.name: entity_id, "genre_id": genre_id} for genre_id in sorted(added)])
+		)
+	if removed or added:
+		change_outbox.record(table.name, "update", entity_id, {"added": sorted(added), "removed": sorted(removed)})
+	return added, removed
+
+
+def geocode_key(value):
+	return " ".join((value or "").lower().split())
+
+
+# (latitude, longitude) of each venue from the geocode table, its street address if that's
+# there and its city otherwise. venues the table doesn't know keep what they had.
+# a core update per venue that moved, returns the ids of those
+def locate_venues(venue_ids=None):
+	venues = db.session.query(Venue.id, Venue.address, Venue.city, Venue.state, Venue.latitude, Venue.longitude)
+	if venue_ids is not None:
+		venues = venues.filter(Venue.id.in_(venue_ids))
+	venues = venues.all()
+	places = {(geocode_key(v.state), geocode_key(v.city)) for v in venues}
+	known = {}
+	if places:
+		rows = db.session.query(Geocode).filter(
+			Geocode.state.in_({state for state, _ in places}), Geocode.city.in_({city for _, city in places})
+		)
+		known = {(g.state, g.city, g.address): (g.latitude, g.longitude) for g in rows}
+	moved = []
+	for v in venues:
+		state, city = geocode_key(v.state), geocode_key(v.city)
+		point = known.get((state, city, geocode_key(v.address))) or known.get((state, city, ""))
+		if point is None or point == (v.latitude, v.longitude):
+			continue
+		db.session.execute(
+			Venue.__table__.update()
+			.where(Venue.id == v.id)
+			.values(latitude=point[0], longitude=point[1], geohash=geo.encode(*point))
+		)
+		change_outbox.record("venue", "update", v.id, {"latitude": point[0], "longitude": point[1]})
+		moved.append(v.id)
+	return moved
+
+
+# a show appears on both its venue and its artist page, so a change on one side
+# has to drop the cached payloads of everything on the other side too
+def invalidate_details(venue_ids=(), artist_ids=()):
+	detail_cache.invalidate(
+		*[f"venue:{i}" for i in venue_ids], *[f"artist:{i}" for i in artist_ids]
+	)
+
+
+def show_partners(venue_id=None, artist_id=None):
+	if venue_id is not None:
+		rows = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id)
+	else:
+		rows = db.session.query(Show.venue_id).filter(Show.artist_id == artist_id)
+	return [r[0] for r in rows.distinct()]
+
+
+# sparse artist x feature matrix: genres, venues played (via show) and home city
+def artist_feature_matrix():
+	ids = [r[0] for r in db.session.query(Artist.id).order_by(Artist.id)]
+	matrix = FeatureSpace().matrix(
+		ids,
+		[
+			("genre", 1.0, db.session.query(artist_genre.c.artist_id, artist_genre.c.genre_id)),
+			("venue", 1.0, db.session.query(Show.artist_id, Show.venue_id).distinct()),
+			("city", 0.5, db.session.query(Artist.id, Artist.city + ", " + Artist.state)),
+		],
+	)
+	return ids, matrix
+
+
+# recomputes the neighbour lists of the given artists (all when None). a change to one artist can
+# move it in or out of the list of anyone sharing a feature with it, so those are refreshed too
+def refresh_similar_artists(artist_ids=None):
+	ids, matrix = artist_feature_matrix()
+	position = {id: i for i, id in enumerate(ids)}
+	if artist_ids is None:
+		targets = set(ids)
+	else:
+		changed = [position[i] for i in artist_ids if i in position]
+		targets = set(artist_ids)
+		targets |= {ids[i] for i in (matrix[changed] @ matrix.T).nonzero()[1]}
+		targets |= {
+			r[0]
+			for r in db.session.query(SimilarArtist.artist_id).filter(
+				SimilarArtist.similar_id.in_(artist_ids)
+			)
+		}
+	neighbours = top_k_cosine(
+		matrix, app.config["SIMILAR_ARTISTS"], [position[i] for i in targets if i in position]
+	)
+	stale = SimilarArtist.query
+	if artist_ids is not None:
+		stale = stale.filter(SimilarArtist.artist_id.in_(targets))
+	stale.delete(synchronize_session=False)
+	db.session.bulk_insert_mappings(
+		SimilarArtist,
+		[
+			{"artist_id": ids[row], "rank": rank, "similar_id": ids[other], "score": score}
+			for row, others in neighbours.items()
+			for rank, (other, score) in enumerate(others)
+		],
+	)
+
+
+# venue rows x artist rows score components, each a (weight, venue matrix, artist matrix) product
+def match_components(venue_ids, artist_ids):
+	weights = app.config["MATCH_WEIGHTS"]
+	components = []
+	for name, venue_pairs, artist_pairs in (
+		(
+			"genre",
+			db.session.query(venue_genre.c.venue_id, venue_genre.c.genre_id),
+			db.session.query(artist_genre.c.artist_id, artist_genre.c.genre_id),
+		),
+		(
+			"city",
+			db.session.query(Venue.id, Venue.city + ", " + Venue.state),
+			db.session.query(Artist.id, Artist.city + ", " + Artist.state),
+		),
+		(
+			"state",
+			db.session.query(Venue.id, Venue.state),
+			db.session.query(Artist.id, Artist.state),
+		),
+	):
+		space = FeatureSpace()
+		venues = space.matrix(venue_ids, [(name, 1.0, venue_pairs)])
+		artists = space.matrix(artist_ids, [(name, 1.0, artist_pairs)])
+		venues = space.align(venues)
+		if name == "genre":
+			venues, artists = normalize_rows(venues), normalize_rows(artists)
+		components.append((weights[name], venues, artists))
+	history = history_matrix(
+		venue_ids,
+		artist_ids,
+		db.session.query(Show.venue_id, Show.artist_id, db.func.count(Show.id)).group_by(
+			Show.venue_id, Show.artist_id
+		),
+	)
+	components.append((weights["history"], history, sparse.identity(len(artist_ids), format="csr")))
+	return components
+
+
+# rescoring a venue means its row against every seeking artist, rescoring an artist its column,
+# so an edit only touches the pairs of the entities that changed. None for both rebuilds everything
+def refresh_matches(venue_ids=None, artist_ids=None):
+	seeking_venues = [r[0] for r in db.session.query(Venue.id).filter(Venue.seeking_talent).order_by(Venue.id)]
+	seeking_artists = [r[0] for r in db.session.query(Artist.id).filter(Artist.seeking_venue).order_by(Artist.id)]
+	full = venue_ids is None and artist_ids is None
+	venue_ids, artist_ids = list(venue_ids or []), list(artist_ids or [])
+	stale = TalentMatch.query
+	if not full:
+		stale = stale.filter(
+			db.or_(TalentMatch.venue_id.in_(venue_ids), TalentMatch.artist_id.in_(artist_ids))
+		)
+	stale.delete(synchronize_session=False)
+	pairs = {}
+	if seeking_venues and seeking_artists:
+		components = match_components(seeking_venues, seeking_artists)
+		min_score = app.config["MATCH_MIN_SCORE"]
+		venue_rows = None if full else [i for i, id in enumerate(seeking_venues) if id in venue_ids]
+		if full or venue_rows:
+			for row, col, score in pair_scores(components, venue_rows, min_score):
+				pairs[(seeking_venues[row], seeking_artists[col])] = score
+		artist_rows = [i for i, id in enumerate(seeking_artists) if id in artist_ids]
+		if artist_rows:
+			flipped = [(weight, right, left) for weight, left, right in components]
+			for row, col, score in pair_scores(flipped, artist_rows, min_score):
+				pairs[(seeking_venues[col], seeking_artists[row])] = score
+	db.session.bulk_insert_mappings(
+		TalentMatch,
+		[{"venue_id": v, "artist_id": a, "score": score} for (v, a), score in pairs.items()],
+	)
+
+
+# similar artists and matches for the given venues and artists in one commit, everything when both are None.
+# the write handlers don't call this, building the feature matrices takes time that grows with the catalog,
+# so `flask refresh-recommendations` picks their changes up from the outbox and refreshes a batch at a time
+def refresh_recommendations(venue_ids=None, artist_ids=None):
+	if venue_ids is None and artist_ids is None:
+		refresh_similar_artists()
+		refresh_matches()
+	else:
+		if artist_ids:
+			refresh_similar_artists(artist_ids)
+		refresh_matches(venue_ids or [], artist_ids or [])
+	db.session.commit()
+
+
+# venue and artist ids a batch of outbox events touched, (None, None) when a bulk change means everything
+def recommendation_targets(events):
+	venue_ids, artist_ids = set(), set()
+	for e in events:
+		if e["entity_id"] is None:
+			return None, None
+		if e["entity"] in ("venue", "venue_genre"):
+			venue_ids.add(e["entity_id"])
+		elif e["entity"] in ("artist", "artist_genre"):
+			artist_ids.add(e["entity_id"])
+		elif e["entity"] == "show":
+			# a show changes its venue's and artist's history, whichever of them the event names
+			venue_ids.update(i for i in [e["changes"].get("venue_id")] if i is not None)
+			artist_ids.update(i for i in [e["changes"].get("artist_id")] if i is not None)
+	return sorted(venue_ids), sorted(artist_ids)
+
+
+def similar_artists(artist_id):
+	rows = (
+		db.session.query(Artist.id, Artist.name, Artist.image_link, SimilarArtist.score)
+		.join(SimilarArtist, SimilarArtist.similar_id == Artist.id)
+		.filter(SimilarArtist.artist_id == artist_id)
+		.order_by(SimilarArtist.rank)
+	)
+	return [
+		{"id": r.id, "name": r.name, "image_link": r.image_link, "score": round(r.score, 2)}
+		for r in rows
+	]
+
+
+# what the given shows contribute to the rollups, {(dimension, key, month): shows}
+def show_facts(venue_id=None, artist_id=None, show_ids=None):
+	query = db.session.query(Show.start_time, Show.venue_id, Show.artist_id)
+	if venue_id is not None:
+		query = query.filter(Show.venue_id == venue_id)
+	if artist_id is not None:
+		query = query.filter(Show.artist_id == artist_id)
+	if show_ids is not None:
+		query = query.filter(Show.id.in_(show_ids))
+	rows = query.all()
+	genres = {}
+	artist_ids = {row.artist_id for row in rows}
+	if artist_ids:
+		for a_id, g_id in db.session.query(artist_genre.c.artist_id, artist_genre.c.genre_id).filter(
+			artist_genre.c.artist_id.in_(artist_ids)
+		):
+			genres.setdefault(a_id, []).append(g_id)
+	facts = {}
+	for row in rows:
+		month = row.start_time.strftime("%Y-%m")
+		keys = [("venue", row.venue_id), ("artist", row.artist_id)]
+		keys += [("genre", g_id) for g_id in genres.get(row.artist_id, [])]
+		for dimension, key in keys:
+			facts[dimension, str(key), month] = facts.get((dimension, str(key), month), 0) + 1
+	return facts
+
+
+# the facts an artist's shows contribute to genres, moved from the removed genre ids to the
+# added ones. read off the artist's own rollups, one query and only when its genres changed
+def regenre_facts(artist_id, added, removed):
+	before, after = {}, {}
+	rows = db.session.query(AnalyticsRollup.month, AnalyticsRollup.shows).filter(
+		AnalyticsRollup.dimension == "artist", AnalyticsRollup.key == str(artist_id)
+	)
+	for month, shows in rows:
+		for genre_id in removed:
+			before["genre", str(genre_id), month] = shows
+		for genre_id in added:
+			after["genre", str(genre_id), month] = shows
+	return before, after
+
+
+# applies the difference between two show_facts snapshots inside the caller's transaction
+def apply_rollup(before, after):
+	rollup = AnalyticsRollup.__table__
+	for key in set(before) | set(after):
+		delta = after.get(key, 0) - before.get(key, 0)
+		if not delta:
+			continue
+		dimension, entity_key, month = key
+		match = db.and_(
+			rollup.c.dimension == dimension, rollup.c.key == entity_key, rollup.c.month == month
+		)
+		updated = db.session.execute(rollup.update().where(match).values(shows=rollup.c.shows + delta))
+		if not updated.rowcount and delta > 0:
+			db.session.execute(
+				rollup.insert().values(dimension=dimension, key=entity_key, month=month, shows=delta)
+			)
+		elif delta < 0:
+			db.session.execute(rollup.delete().where(db.and_(match, rollup.c.shows <= 0)))
+
+
+@app.before_first_request
+def build_name_indexes():
+	venue_index.build(db.session.query(Venue.id, Venue.name))
+	artist_index.build(db.session.query(Artist.id, Artist.name))
+
+
+# a serving worker compiles every template before its first page instead of on each one's first render.
+# at startup and not import, so cli commands and scripts importing the app don't write the cache
+@app.before_first_request
+def compile_templates_on_start():
+	if app.config.get("TEMPLATE_PRECOMPILE"):
+		precompile_templates()
+
+
 # ----------------------------------------------------------------------------#
 # Controllers.
 # ----------------------------------------------------------------------------#
 
 
 @app.route("/")
+@query_budget(0)
 def index():
 	return render_template("pages/home.html")
 
@@ -228,12 +1086,19 @@ def index():
 
 # done
 @app.route("/venues")
+@query_budget(2)
 def venues():
 	# TODO: replace with real venues data.
 	#       num_shows should be aggregated based on number of upcoming shows per venue.
 	try:
 		# get all the venues from Venue table and order them by state and city
-		v = db.session.query(Venue).order_by(Venue.state, db.func.lower(Venue.city)).all()
+		v = (
+			db.session.query(Venue.id, Venue.name, Venue.city, Venue.state)
+			.order_by(Venue.state, db.func.lower(Venue.city))
+			.all()
+		)
+		# one grouped count instead of loading every venue's shows
+		counts = upcoming_show_counts(Show.venue_id, [venue.id for venue in v])
 		# hedious code block done this way to preserve scalability O(n) passes
 		# there could have been a better way to code it but not better time complixety
 		data = []
@@ -246,12 +1111,11 @@ def venues():
 					data.append({"city": current_city, "state": current_state, "venues": venues})
 					current_state, current_city = venue.state, venue.city
 					venues = []
-				_, up_coming = show_times(venue)
 				venues.append(
 					{
 						"id": venue.id,
 						"name": venue.name,
-						"num_upcoming_shows": len(up_coming),
+						"num_upcoming_shows": counts.get(venue.id, 0),
 					})
 			# quick fix, for the last city, state and their venues that get's left out
 			data.append({"city": current_city, "state": current_state, "venues": venues})
@@ -284,6 +1148,7 @@ def venues():
 
 # done
 @app.route("/venues/search", methods=["POST"])
+@query_budget(1)
 def search_venues():
 	# TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
 	# seach for Hop should return "The Musical Hop".
@@ -292,12 +1157,20 @@ def search_venues():
 	# implementing partialy maching search_term
 	search = f"%{request.form.get('search_term')}%"
 	# using ilike() for the search to be case insensitive
-	venues = db.session.query(Venue).filter(Venue.name.ilike(search)).all()
+	# upcoming shows counted in the same statement, outer joined so venues without any still match
+	upcoming = db.and_(Show.venue_id == Venue.id, Show.start_time >= datetime.datetime.now())
+	venues = (
+		db.session.query(Venue.id, Venue.name, db.func.count(Show.id))
+		.outerjoin(Show, upcoming)
+		.filter(Venue.name.ilike(search))
+		.group_by(Venue.id, Venue.name)
+		.all()
+	)
 	response = {
 		"count": len(venues),
 		"data": [
-			{"id": v.id, "name": v.name, "num_upcoming_shows": len(show_times(v)[1]),}
-			for v in venues
+			{"id": id, "name": name, "num_upcoming_shows": count,}
+			for id, name, count in venues
 		],
 	}
 	""" response = {
@@ -313,33 +1186,13 @@ def search_venues():
 
 # done
 @app.route("/venues/<int:venue_id>")
+@query_budget(1)
 def show_venue(venue_id):
 	# shows the venue page with the given venue_id
 	# TODO: replace with real venue data from the venues table, using venue_id
 	try:
-		# v short for venue
-		v = Venue.query.get(venue_id)
-		if v:
-			past_shows, upcoming_shows = show_times(v)
-			data = {
-				"id": venue_id,
-				"name": v.name,
-				"genres": [g.name for g in v.genres],
-				"address": v.address,
-				"city": v.city,
-				"state": v.state,
-				"phone": v.phone,
-				"website": v.website,
-				"facebook_link": v.facebook_link,
-				"seeking_talent": v.seeking_talent,
-				"seeking_description": v.seeking_description,
-				"image_link": v.image_link,
-				"past_shows": show_response_format_4_venue(past_shows),
-				"upcoming_shows": show_response_format_4_venue(upcoming_shows),
-				"past_shows_count": len(past_shows),
-				"upcoming_shows_count": len(upcoming_shows),
-			}
-		else:
+		data = detail_cache.get_or_set(f"venue:{venue_id}", lambda: venue_payload(venue_id))
+		if not data:
 			data = {"name": "no venue with that id"}
 	except Exception as e:
 		print(e)
@@ -429,7 +1282,7 @@ def show_venue(venue_id):
 		"upcoming_shows_count": 1,
 	} """
 	# data = list(filter(lambda d: d["id"] == venue_id, [data1, data2, data3]))[0]
-	return render_template("pages/show_venue.html", venue=data)
+	return render_template("pages/show_venue.html", venue=detail_tiles(data, "artist"))
 
 
 #  Create Venue
@@ -437,6 +1290,7 @@ def show_venue(venue_id):
 
 # done
 @app.route("/venues/create", methods=["GET"])
+@query_budget(0)
 def create_venue_form():
 	form = VenueForm()
 	return render_template("forms/new_venue.html", form=form)
@@ -464,7 +1318,11 @@ def create_venue_submission():
 			g = Genre.query.filter_by(name=genre).first()
 			g.venues.append(v)
 		db.session.add(v)
+		db.session.flush()
+		locate_venues([v.id])
+		refresh_documents(venue_ids=[v.id])
 		db.session.commit()
+		venue_index.add(v.id, data["name"])
 		# on successful db insert, flash success
 		flash(f"Venue {data['name']}  was successfully listed!")
 	except Exception as e:
@@ -484,10 +1342,16 @@ def delete_venue(venue_id):
 	# SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
 	try:
 		v = Venue.query.get(venue_id)
+		artist_ids = show_partners(venue_id=v.id)
+		apply_rollup(show_facts(venue_id=v.id), {})
+		live_shows.announce("cancelled", show_events(venue_id=v.id))
 		db.session.delete(v)
 		v.genres = []
 		v.shows = []
+		refresh_documents(venue_ids=[v.id], artist_ids=artist_ids)
 		db.session.commit()
+		venue_index.remove(int(venue_id))
+		invalidate_details(venue_ids=[int(venue_id)], artist_ids=artist_ids)
 		flash("successfuly deleted")
 	except Exception as e:
 		db.session.rollback()
@@ -505,6 +1369,7 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 # done
 @app.route("/artists")
+@query_budget(1)
 def artists():
 	# TODO: replace with real data returned from querying the database
 	try:
@@ -523,6 +1388,7 @@ def artists():
 
 # done
 @app.route("/artists/search", methods=["POST"])
+@query_budget(1)
 def search_artists():
 	# TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
 	# seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
@@ -530,12 +1396,19 @@ def search_artists():
 
 	# case-insensitive, partialy matched search
 	search = f"%{request.form.get('search_term')}%"
-	artists = db.session.query(Artist).filter(Artist.name.ilike(search)).all()
+	upcoming = db.and_(Show.artist_id == Artist.id, Show.start_time >= datetime.datetime.now())
+	artists = (
+		db.session.query(Artist.id, Artist.name, db.func.count(Show.id))
+		.outerjoin(Show, upcoming)
+		.filter(Artist.name.ilike(search))
+		.group_by(Artist.id, Artist.name)
+		.all()
+	)
 	response = {
 		"count": len(artists),
 		"data": [
-			{"id": a.id, "name": a.name, "num_upcoming_shows": len(show_times(a)[1]),}
-			for a in artists
+			{"id": id, "name": name, "num_upcoming_shows": count,}
+			for id, name, count in artists
 		],
 	}
 	""" response = {
@@ -551,31 +1424,13 @@ def search_artists():
 
 # done
 @app.route("/artists/<int:artist_id>")
+@query_budget(2)
 def show_artist(artist_id):
 	# shows the venue page with the given venue_id
 	# TODO: replace with real venue data from the venues table, using venue_id
 	try:
-		a = Artist.query.get(artist_id)
-		if a:
-			past_shows, upcoming_shows = show_times(a)
-			data = {
-				"id": a.id,
-				"name": a.name,
-				"genres": [g.name for g in a.genres],
-				"city": a.city,
-				"state": a.state,
-				"phone": a.phone,
-				"website": a.website,
-				"facebook_link": a.facebook_link,
-				"seeking_venue": a.seeking_venue,
-				"seeking_description": a.seeking_description,
-				"image_link": a.image_link,
-				"past_shows": show_response_format_4_artist(past_shows),
-				"upcoming_shows": show_response_format_4_artist(upcoming_shows),
-				"past_shows_count": len(past_shows),
-				"upcoming_shows_count": len(upcoming_shows),
-			}
-		else:
+		data = detail_cache.get_or_set(f"artist:{artist_id}", lambda: artist_payload(artist_id))
+		if not data:
 			data = {"name": "no venue with that id"}
 	except Exception as e:
 		print(e)
@@ -659,12 +1514,17 @@ def show_artist(artist_id):
 		"upcoming_shows_count": 3,
 	}
 	data = list(filter(lambda d: d["id"] == artist_id, [data1, data2, data3]))[0]"""
-	return render_template("pages/show_artist.html", artist=data)
+	return render_template(
+		"pages/show_artist.html",
+		artist=detail_tiles(data, "venue"),
+		similar_artists=similar_artists(artist_id),
+	)
 
 
 #  Update
 #  ----------------------------------------------------------------
 @app.route("/artists/<int:artist_id>/edit", methods=["GET"])
+@query_budget(1)
 def edit_artist(artist_id):
 	form = ArtistForm()
 	""" artist = {
@@ -693,19 +1553,44 @@ def edit_artist_submission(artist_id):
 	# artist record with ID <artist_id> using the new attributes
 	try:
 		data = request.form
-		a = Artist.query.get(artist_id)
-		a.name = data["name"]
-		a.city = data["city"]
-		a.state = data["state"]
-		a.phone = data["phone"]
-		a.facebook_link = data["facebook_link"]
-		genres = data.getlist("genres")
-		# clearing the genres of artist  and adding new ones
-		a.genres = []
-		for genre in genres:
-			g = Genre.query.filter_by(name=genre).first()
-			a.genres.append(g)
+		version = data.get("version", type=int)
+		changed = update_if_changed(
+			Artist,
+			artist_id,
+			{
+				"name": data["name"],
+				"city": data["city"],
+				"state": data["state"],
+				"phone": data["phone"],
+				"facebook_link": data["facebook_link"],
+			},
+			version,
+		)
+		added, removed = sync_genres(
+			artist_genre, artist_genre.c.artist_id, artist_id, data.getlist("genres")
+		)
+		genres_changed = bool(added or removed)
+		if genres_changed and not changed:
+			bump_version(Artist, artist_id, version)
+		# nothing to write, nothing to refresh
+		if not (changed or genres_changed):
+			return redirect(url_for("show_artist", artist_id=artist_id))
+		venue_ids = show_partners(artist_id=artist_id)
+		# renames show up in the reports by themselves, only a genre change moves shows
+		if genres_changed:
+			apply_rollup(*regenre_facts(artist_id, added, removed))
+		live_shows.announce("updated", show_events(artist_id=artist_id))
+		refresh_documents(venue_ids=venue_ids, artist_ids=[artist_id])
 		db.session.commit()
+		artist_index.add(artist_id, data["name"])
+		invalidate_details(venue_ids=venue_ids, artist_ids=[artist_id])
+	except EditConflict:
+		db.session.rollback()
+		flash(
+			"Artist was changed by someone else while you were editing it. "
+			"The form now shows their changes, please make yours again."
+		)
+		return redirect(url_for("edit_artist", artist_id=artist_id))
 	except Exception as e:
 		db.session.rollback()
 		print(e)
@@ -715,6 +1600,7 @@ def edit_artist_submission(artist_id):
 
 
 @app.route("/venues/<int:venue_id>/edit", methods=["GET"])
+@query_budget(1)
 def edit_venue(venue_id):
 	form = VenueForm()
 	""" venue = {
@@ -742,18 +1628,44 @@ def edit_venue_submission(venue_id):
 	# venue record with ID <venue_id> using the new attributes
 	try:
 		data = request.form
-		v = Venue.query.get(venue_id)
-		v.name = data["name"]
-		v.city = data["city"]
-		v.state = data["state"]
-		v.phone = data["phone"]
-		v.facebook_link = data["facebook_link"]
-		genres = data.getlist("genres")
-		v.genres = []
-		for genre in genres:
-			g = Genre.query.filter_by(name=genre).first()
-			v.genres.append(g)
+		version = data.get("version", type=int)
+		changed = update_if_changed(
+			Venue,
+			venue_id,
+			{
+				"name": data["name"],
+				"city": data["city"],
+				"state": data["state"],
+				"phone": data["phone"],
+				"facebook_link": data["facebook_link"],
+			},
+			version,
+		)
+		added, removed = sync_genres(
+			venue_genre, venue_genre.c.venue_id, venue_id, data.getlist("genres")
+		)
+		genres_changed = bool(added or removed)
+		if genres_changed and not changed:
+			bump_version(Venue, venue_id, version)
+		if not (changed or genres_changed):
+			return redirect(url_for("show_venue", venue_id=venue_id))
+		if changed:
+			locate_venues([venue_id])
+		# the rollups key the venue by id and its city is joined in when reporting,
+		# so a rename or a move leaves them as they are
+		artist_ids = show_partners(venue_id=venue_id)
+		live_shows.announce("updated", show_events(venue_id=venue_id))
+		refresh_documents(venue_ids=[venue_id], artist_ids=artist_ids)
 		db.session.commit()
+		venue_index.add(venue_id, data["name"])
+		invalidate_details(venue_ids=[venue_id], artist_ids=artist_ids)
+	except EditConflict:
+		db.session.rollback()
+		flash(
+			"Venue was changed by someone else while you were editing it. "
+			"The form now shows their changes, please make yours again."
+		)
+		return redirect(url_for("edit_venue", venue_id=venue_id))
 	except Exception as e:
 		db.session.rollback()
 		print(e)
@@ -767,6 +1679,7 @@ def edit_venue_submission(venue_id):
 
 # done
 @app.route("/artists/create", methods=["GET"])
+@query_budget(0)
 def create_artist_form():
 	form = ArtistForm()
 	return render_template("forms/new_artist.html", form=form)
@@ -790,7 +1703,10 @@ def create_artist_submission():
 			g = Genre.query.filter_by(name=genre).first()
 			g.artists.append(a)
 		db.session.add(a)
+		db.session.flush()
+		refresh_documents(artist_ids=[a.id])
 		db.session.commit()
+		artist_index.add(a.id, data["name"])
 		# on successful db insert, flash success
 		flash(f"Artist {data['name']} was successfully listed!")
 	except Exception as e:
@@ -804,27 +1720,449 @@ def create_artist_submission():
 	return render_template("pages/home.html")
 
 
+#  Matches
+#  ----------------------------------------------------------------
+
+
+@app.route("/venues/<int:venue_id>/matches")
+@query_budget(1)
+def venue_matches(venue_id):
+	# best seeking artists for a seeking venue, straight off the (venue_id, score) index
+	k = min(request.args.get("k", 10, type=int), 100)
+	rows = (
+		db.session.query(Artist.id, Artist.name, Artist.city, Artist.state, TalentMatch.score)
+		.join(TalentMatch, TalentMatch.artist_id == Artist.id)
+		.filter(TalentMatch.venue_id == venue_id)
+		.order_by(TalentMatch.score.desc())
+		.limit(k)
+	)
+	return jsonify(
+		venue_id=venue_id,
+		matches=[
+			{"artist_id": r.id, "name": r.name, "city": r.city, "state": r.state, "score": round(r.score, 3)}
+			for r in rows
+		],
+	)
+
+
+# a point and a radius from the query string, None for a missing or impossible point
+def nearby_args():
+	lat, lng = request.args.get("lat", type=float), request.args.get("lng", type=float)
+	if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+		return None
+	max_radius = app.config.get("GEO_MAX_RADIUS_KM", 100)
+	radius = request.args.get("radius", type=float)
+	return lat, lng, min(radius, max_radius) if radius and radius > 0 else None, max_radius
+
+
+@app.route("/venues/nearby")
+@query_budget(4)
+def nearby_venues():
+	# ?lat=&lng= and either radius (km) for every venue within it, or k for the k nearest
+	# (default 10) up to GEO_MAX_RADIUS_KM away. reads only the grid cells around the point
+	args = nearby_args()
+	if args is None:
+		return jsonify(error="lat and lng are required"), 400
+	lat, lng, radius, max_radius = args
+	k = min(request.args.get("k", 10, type=int), 100)
+
+	def search(cells):
+		return (
+			db.session.query(
+				Venue.id, Venue.name, Venue.address, Venue.city, Venue.state, Venue.latitude, Venue.longitude
+			)
+			.filter(geo.cell_filter(Venue.geohash, cells))
+			.all()
+		)
+
+	if radius:
+		found = geo.within(search(geo.covering(lat, lng, radius)), lat, lng, radius)
+	else:
+		found = geo.nearest(search, lat, lng, k, max_radius)
+	return jsonify(
+		venues=[
+			{
+				"id": v.id,
+				"name": v.name,
+				"address": v.address,
+				"city": v.city,
+				"state": v.state,
+				"latitude": v.latitude,
+				"longitude": v.longitude,
+				"distance_km": round(distance, 3),
+			}
+			for distance, v in found
+		]
+	)
+
+
+@app.route("/shows/nearby")
+@query_budget(1)
+def nearby_shows():
+	# upcoming shows at venues within radius km of ?lat=&lng= (default 25), soonest first.
+	# takes the /shows filters too
+	args = nearby_args()
+	if args is None:
+		return jsonify(error="lat and lng are required"), 400
+	lat, lng, radius, _ = args
+	radius = radius or 25
+	filters = request.args.copy()
+	filters.setdefault("start", str(datetime.datetime.now()))
+	rows = (
+		filtered_shows(filters)
+		.add_columns(Venue.latitude, Venue.longitude)
+		.filter(geo.cell_filter(Venue.geohash, geo.covering(lat, lng, radius)))
+		.limit(app.config.get("GEO_MAX_SHOWS", 500))
+	)
+	shows = []
+	for s in rows:
+		distance = geo.distance_km(lat, lng, s.latitude, s.longitude)
+		if distance <= radius:
+			shows.append(
+				{
+					"id": s.id,
+					"start_time": str(s.start_time),
+					"venue_id": s.venue_id,
+					"venue_name": s.venue_name,
+					"city": s.city,
+					"state": s.state,
+					"artist_id": s.artist_id,
+					"artist_name": s.artist_name,
+					"distance_km": round(distance, 3),
+				}
+			)
+	return jsonify(shows=shows)
+
+
+@app.route("/artists/<int:artist_id>/matches")
+@query_budget(1)
+def artist_matches(artist_id):
+	k = min(request.args.get("k", 10, type=int), 100)
+	rows = (
+		db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, TalentMatch.score)
+		.join(TalentMatch, TalentMatch.venue_id == Venue.id)
+		.filter(TalentMatch.artist_id == artist_id)
+		.order_by(TalentMatch.score.desc())
+		.limit(k)
+	)
+	return jsonify(
+		artist_id=artist_id,
+		matches=[
+			{"venue_id": r.id, "name": r.name, "city": r.city, "state": r.state, "score": round(r.score, 3)}
+			for r in rows
+		],
+	)
+
+
+#  Analytics
+#  ----------------------------------------------------------------
+
+
+# trend reports computed from analytics_rollup only, rankings via window functions
+# "YYYY-MM" of the first of the months months ending with today's, months=1 is this month alone
+def analytics_since(today, months):
+	year, month = divmod(today.year * 12 + today.month - 1 - (months - 1), 12)
+	return f"{year:04d}-{month + 1:02d}"
+
+
+def analytics_report(months=12):
+	R = AnalyticsRollup
+	since = analytics_since(datetime.date.today(), months)
+
+	# rollups of one dimension joined to the rows their keys are the ids of, for the names
+	def rollups(dimension, model, *columns):
+		return (
+			db.session.query(*columns)
+			.select_from(R)
+			.join(model, R.key == db.cast(model.id, db.String))
+			.filter(R.dimension == dimension, R.month >= since)
+		)
+
+	def ranked(dimension, model, limit=10):
+		total = db.func.sum(R.shows)
+		rows = (
+			rollups(
+				dimension,
+				model,
+				R.key,
+				model.name.label("label"),
+				total.label("shows"),
+				db.func.rank().over(order_by=total.desc()).label("rank"),
+			)
+			.group_by(R.key, model.name)
+			.order_by(total.desc(), R.key)
+			.limit(limit)
+		)
+		return [{"key": r.key, "label": r.label, "shows": r.shows, "rank": r.rank} for r in rows]
+
+	def monthly(dimension, model, key, label, *group_by):
+		total = db.func.sum(R.shows)
+		rows = (
+			rollups(
+				dimension,
+				model,
+				R.month,
+				key.label("key"),
+				label.label("label"),
+				total.label("shows"),
+				db.func.rank().over(partition_by=R.month, order_by=total.desc()).label("rank"),
+				db.cast(db.func.sum(total).over(partition_by=R.month), db.Integer).label("month_total"),
+			)
+			.group_by(R.month, *group_by)
+			.order_by(R.month, total.desc(), key)
+		)
+		return [
+			{
+				"month": r.month,
+				"key": r.key,
+				"label": r.label,
+				"shows": r.shows,
+				"rank": r.rank,
+				"share": round(r.shows / r.month_total, 3) if r.month_total else 0,
+			}
+			for r in rows
+		]
+
+	# a city's shows are its venues', summed under wherever each venue is now
+	place = Venue.city + ", " + Venue.state
+	return {
+		"since": since,
+		"shows_per_city": monthly("venue", Venue, place, place, Venue.city, Venue.state),
+		"genre_mix": monthly("genre", Genre, R.key, Genre.name, R.key, Genre.name),
+		"busiest_venues": ranked("venue", Venue),
+		"most_booked_artists": ranked("artist", Artist),
+	}
+
+
+@app.route("/analytics")
+@query_budget(4)
+def analytics():
+	months = min(max(request.args.get("months", 12, type=int), 1), 120)
+	return render_template("pages/analytics.html", report=analytics_report(months), months=months)
+
+
+@app.route("/analytics.json")
+@query_budget(4)
+def analytics_json():
+	months = min(max(request.args.get("months", 12, type=int), 1), 120)
+	return jsonify(analytics_report(months))
+
+
+#  Genres
+#  ----------------------------------------------------------------
+
+
+# artists, venues and upcoming shows per genre id as three grouped queries over the
+# genre_id indexes of the association tables, optionally narrowed to one city/state
+def genre_facets(city=None, state=None):
+	def located(query, model):
+		if state:
+			query = query.filter(model.state == state.upper())
+		if city:
+			query = query.filter(db.func.lower(model.city) == city.strip().lower())
+		return query
+
+	artists = located(
+		db.session.query(artist_genre.c.genre_id, db.func.count(artist_genre.c.artist_id))
+		.join(Artist, Artist.id == artist_genre.c.artist_id),
+		Artist,
+	).group_by(artist_genre.c.genre_id)
+	venues = located(
+		db.session.query(venue_genre.c.genre_id, db.func.count(venue_genre.c.venue_id))
+		.join(Venue, Venue.id == venue_genre.c.venue_id),
+		Venue,
+	).group_by(venue_genre.c.genre_id)
+	shows = located(
+		db.session.query(artist_genre.c.genre_id, db.func.count(Show.id))
+		.join(Show, Show.artist_id == artist_genre.c.artist_id)
+		.join(Venue, Venue.id == Show.venue_id)
+		.filter(Show.start_time >= datetime.datetime.now()),
+		Venue,
+	).group_by(artist_genre.c.genre_id)
+	return {
+		"artists": dict(artists.all()),
+		"venues": dict(venues.all()),
+		"upcoming_shows": dict(shows.all()),
+	}
+
+
+def genre_rows(facets):
+	return [
+		{
+			"id": g.id,
+			"name": g.name,
+			"num_artists": facets["artists"].get(g.id, 0),
+			"num_venues": facets["venues"].get(g.id, 0),
+			"num_upcoming_shows": facets["upcoming_shows"].get(g.id, 0),
+		}
+		for g in Genre.query.order_by(Genre.name)
+	]
+
+
+def city_choices():
+	rows = db.session.query(Venue.city, Venue.state).distinct().order_by(Venue.state, Venue.city)
+	return [{"city": city, "state": state} for city, state in rows]
+
+
+@app.route("/genres")
+@query_budget(5)
+def genres():
+	city, state = request.args.get("city"), request.args.get("state")
+	return render_template(
+		"pages/genres.html",
+		genres=genre_rows(genre_facets(city, state)),
+		cities=city_choices(),
+		city=city,
+		state=state,
+	)
+
+
+@app.route("/genres/<int:genre_id>")
+@query_budget(9)
+def show_genre(genre_id):
+	genre = Genre.query.get_or_404(genre_id)
+	city, state = request.args.get("city"), request.args.get("state")
+	artists = db.session.query(Artist.id, Artist.name).join(
+		artist_genre, artist_genre.c.artist_id == Artist.id
+	).filter(artist_genre.c.genre_id == genre_id)
+	venues = db.session.query(Venue.id, Venue.name).join(
+		venue_genre, venue_genre.c.venue_id == Venue.id
+	).filter(venue_genre.c.genre_id == genre_id)
+	if state:
+		artists = artists.filter(Artist.state == state.upper())
+		venues = venues.filter(Venue.state == state.upper())
+	if city:
+		artists = artists.filter(db.func.lower(Artist.city) == city.strip().lower())
+		venues = venues.filter(db.func.lower(Venue.city) == city.strip().lower())
+	args = request.args.copy()
+	args["genre"] = genre.name
+	args.setdefault("start", str(datetime.datetime.now()))
+	upcoming = [
+		{
+			"id": s.id,
+			"venue_id": s.venue_id,
+			"venue_name": s.venue_name,
+			"artist_id": s.artist_id,
+			"artist_name": s.artist_name,
+			"artist_image_link": s.artist_image_link,
+			"start_time": str(s.start_time),
+		}
+		for s in filtered_shows(args)
+	]
+	return render_template(
+		"pages/show_genre.html",
+		genre=genre,
+		artists=artists.order_by(Artist.name).all(),
+		venues=venues.order_by(Venue.name).all(),
+		shows=show_tiles(upcoming),
+		facets=genre_rows(genre_facets(city, state)),
+		cities=city_choices(),
+		city=city,
+		state=state,
+	)
+
+
+#  Search
+#  ----------------------------------------------------------------
+
+
+# rank 0 exact name, 1 name prefix, 2 name contains, 3 city/state match
+def search_rank(column, term):
+	return db.case(
+		[
+			(db.func.lower(column) == term.lower(), 0),
+			(column.ilike(f"{term}%"), 1),
+			(column.ilike(f"%{term}%"), 2),
+		],
+		else_=3,
+	)
+
+
+@app.route("/search", methods=["GET", "POST"])
+@query_budget(3)
+def search():
+	# venues, artists, genres and cities in one ranked UNION ALL, then one aggregate for show counts
+	term = (request.values.get("search_term") or "").strip()
+	response = {"count": 0, "venues": [], "artists": [], "genres": [], "cities": []}
+	if term:
+		search = f"%{term}%"
+		selects = []
+		for kind, model in (("venue", Venue), ("artist", Artist)):
+			place = model.city + ", " + model.state
+			selects.append(
+				db.select(
+					[
+						db.literal(kind).label("kind"),
+						model.id.label("id"),
+						model.name.label("name"),
+						search_rank(model.name, term).label("rank"),
+					]
+				).where(db.or_(model.name.ilike(search), place.ilike(search)))
+			)
+			selects.append(
+				db.select(
+					[
+						db.literal("city").label("kind"),
+						# a typed NULL, postgres reads a bare NULL parameter as text and refuses to union it with ids
+						db.cast(db.null(), db.Integer).label("id"),
+						place.label("name"),
+						search_rank(place, term).label("rank"),
+					]
+				)
+				.where(place.ilike(search))
+				.distinct()
+			)
+		selects.append(
+			db.select(
+				[
+					db.literal("genre").label("kind"),
+					Genre.id.label("id"),
+					Genre.name.label("name"),
+					search_rank(Genre.name, term).label("rank"),
+				]
+			).where(Genre.name.ilike(search))
+		)
+		ranked = db.union_all(*selects).order_by(
+			db.literal_column("rank"), db.literal_column("name")
+		)
+		seen = set()
+		for row in db.session.execute(ranked):
+			if (row.kind, row.id, row.name) in seen:
+				continue
+			seen.add((row.kind, row.id, row.name))
+			response[row.kind + "s" if row.kind != "city" else "cities"].append(
+				{"id": row.id, "name": row.name}
+			)
+		for group, column in (("venues", Show.venue_id), ("artists", Show.artist_id)):
+			counts = upcoming_show_counts(column, [hit["id"] for hit in response[group]])
+			for hit in response[group]:
+				hit["num_upcoming_shows"] = counts.get(hit["id"], 0)
+		response["count"] = sum(len(response[group]) for group in ("venues", "artists", "genres", "cities"))
+	return render_template("pages/search.html", results=response, search_term=term)
+
+
 #  Shows
 #  ----------------------------------------------------------------
 
 # done
 @app.route("/shows")
+@query_budget(2)
 def shows():
 	# displays list of shows at /shows
 	# TODO: replace with real venues data.
 	#       num_shows should be aggregated based on number of upcoming shows per venue.
-	shows = Show.query.all()
-	# list comprehension
+	# venue and artist columns come back with the show rows, no lazy loads per tile
 	data = [
 		{
+			"id": s.id,
 			"venue_id": s.venue_id,
-			"venue_name": s.venue.name,
+			"venue_name": s.venue_name,
 			"artist_id": s.artist_id,
-			"artist_name": s.artist.name,
-			"artist_imag": s.artist.image_link,
+			"artist_name": s.artist_name,
+			"artist_image_link": s.artist_image_link,
 			"start_time": str(s.start_time),
 		}
-		for s in shows
+		for s in filtered_shows(request.args)
 	]
 	""" data = [
 		{
@@ -868,11 +2206,49 @@ def shows():
 			"start_time": "2035-04-15T20:00:00.000Z",
 		},
 	] """
-	return render_template("pages/shows.html", shows=data)
+	return render_template(
+		"pages/shows.html",
+		shows=show_tiles(data),
+		filters=request.args,
+		genres=[g.name for g in Genre.query.order_by(Genre.name)],
+	)
+
+
+@app.route("/shows/stream")
+def show_stream():
+	# server-sent events for the kiosk displays, takes the same filters as /shows
+	live_shows.start()
+	start = parse_filter_date(request.args.get("start"))
+	end = parse_filter_date(request.args.get("end"), end=True)
+	filters = {
+		"venue_id": request.args.get("venue_id", type=int),
+		"artist_id": request.args.get("artist_id", type=int),
+		"state": (request.args.get("state") or "").upper(),
+		"city": (request.args.get("city") or "").strip().lower(),
+		"genre": request.args.get("genre"),
+		"start": start.isoformat() if start else None,
+		"end": end.isoformat() if end else None,
+	}
+	subscription = broadcaster.subscribe(filters, request.headers.get("Last-Event-ID"))
+	response = Response(
+		live.sse(subscription, broadcaster, app.config.get("LIVE_HEARTBEAT", 15)),
+		mimetype="text/event-stream",
+	)
+	response.headers["Cache-Control"] = "no-cache"
+	# nginx would otherwise buffer the stream
+	response.headers["X-Accel-Buffering"] = "no"
+	return response
+
+
+@app.route("/shows/stream/stats")
+@query_budget(0)
+def show_stream_stats():
+	return jsonify(broadcaster.stats())
 
 
 # done
 @app.route("/shows/create")
+@query_budget(0)
 def create_shows():
 	# renders form. do not touch.
 	form = ShowForm()
@@ -890,11 +2266,16 @@ def create_show_submission():
 		a = Artist.query.get(data["artist_id"])
 		v = Venue.query.get(data["venue_id"])
 		if a and v:
-			s = Show(artist=a, venue=v, start_time=data["start_time"])
+			s = Show(artist=a, venue=v, start_time=dateutil.parser.parse(data["start_time"]))
 			db.session.add(s)
 		else:
 			raise Exception("Either the venue or the artist doesn't exist")
+		db.session.flush()
+		apply_rollup({}, show_facts(show_ids=[s.id]))
+		live_shows.announce("created", show_events(show_ids=[s.id]))
+		refresh_documents(venue_ids=[v.id], artist_ids=[a.id])
 		db.session.commit()
+		invalidate_details(venue_ids=[v.id], artist_ids=[a.id])
 		# on successful db insert, flash success
 		flash("Show was successfully listed!")
 	# TODO: on unsuccessful db insert, flash an error instead.
@@ -908,6 +2289,172 @@ def create_show_submission():
 	return render_template("pages/home.html")
 
 
+#  Feeds
+#  ----------------------------------------------------------------
+
+feed_formats = {
+	"ics": ("text/calendar; charset=utf-8", feeds.ical),
+	"csv": ("text/csv; charset=utf-8", lambda rows, name: feeds.csv_rows(rows)),
+}
+
+
+# streams every show matching filters from a server-side cursor, so memory stays flat however
+# many shows there are. the etag comes from one aggregate plus the read model timestamps, which
+# move whenever a name or address on either side of a show changes
+def show_feed(fmt, name, filters, documents):
+	if fmt not in feed_formats:
+		return not_found_error(None)
+	# every row a feed entry is rendered from goes into the etag, a venue's new address
+	# changes its artists' feeds too though their documents stay as they were
+	stamps = (
+		db.session.query(
+			db.func.count(Show.id),
+			db.func.max(Show.id),
+			db.func.max(Show.start_time),
+			db.func.max(Show.updated_at),
+			db.func.max(Venue.updated_at),
+			db.func.max(Artist.updated_at),
+		)
+		.join(Venue, Show.venue_id == Venue.id)
+		.join(Artist, Show.artist_id == Artist.id)
+		.filter(*filters)
+		.one()
+	)
+	changed = documents.with_entities(db.func.max(ReadModel.updated_at)).scalar()
+	etag = hashlib.sha1("|".join(map(str, (fmt, *stamps, changed))).encode()).hexdigest()
+	if etag in request.if_none_match:
+		response = Response(status=304)
+		response.set_etag(etag)
+		return response
+	rows = (
+		db.session.query(
+			Show.id,
+			Show.start_time,
+			Show.artist_id,
+			Artist.name.label("artist_name"),
+			Show.venue_id,
+			Venue.name.label("venue_name"),
+			Venue.address,
+			Venue.city,
+			Venue.state,
+		)
+		.join(Venue, Show.venue_id == Venue.id)
+		.join(Artist, Show.artist_id == Artist.id)
+		.filter(*filters)
+		.order_by(Show.start_time, Show.id)
+		.execution_options(stream_results=True)
+		.yield_per(500)
+	)
+	mimetype, render = feed_formats[fmt]
+	response = Response(stream_with_context(render(rows, name)), mimetype=mimetype)
+	response.set_etag(etag)
+	response.headers["Cache-Control"] = "public, max-age=300"
+	return response
+
+
+@app.route("/venues/<int:venue_id>/shows.<fmt>")
+@query_budget(4)
+def venue_feed(venue_id, fmt):
+	venue = db.session.query(Venue.name).filter(Venue.id == venue_id).first_or_404()
+	documents = ReadModel.query.filter_by(entity="venue", entity_id=venue_id)
+	return show_feed(fmt, venue.name, [Show.venue_id == venue_id], documents)
+
+
+@app.route("/artists/<int:artist_id>/shows.<fmt>")
+@query_budget(4)
+def artist_feed(artist_id, fmt):
+	artist = db.session.query(Artist.name).filter(Artist.id == artist_id).first_or_404()
+	documents = ReadModel.query.filter_by(entity="artist", entity_id=artist_id)
+	return show_feed(fmt, artist.name, [Show.artist_id == artist_id], documents)
+
+
+@app.route("/cities/<state>/<city>/shows.<fmt>")
+@query_budget(3)
+def city_feed(state, city, fmt):
+	in_city = [Venue.state == state.upper(), db.func.lower(Venue.city) == city.lower()]
+	documents = ReadModel.query.join(
+		Venue, db.and_(ReadModel.entity == "venue", ReadModel.entity_id == Venue.id)
+	).filter(*in_city)
+	return show_feed(fmt, f"{city}, {state.upper()}", in_city, documents)
+
+
+#  Cache
+#  ----------------------------------------------------------------
+
+
+# whether url is the image_link of a venue or an artist
+def known_image(url):
+	if not url:
+		return False
+	venues = db.session.query(Venue.id).filter(Venue.image_link == url)
+	artists = db.session.query(Artist.id).filter(Artist.image_link == url)
+	return venues.union_all(artists).first() is not None
+
+
+@app.route("/thumbs/<int:width>.<fmt>")
+def thumbnail(width, fmt):
+	src = request.args.get("src", "")
+	if fmt not in IMAGE_FORMATS or width not in image_store.widths or not image_store.available:
+		abort(404)
+	digest = image_store.digest(src, fetch=False)
+	if digest is None:
+		# only a venue's or artist's own image is fetched on demand. any other src would have
+		# us download whatever url it's given and keep it for good
+		if not known_image(src):
+			abort(404)
+		try:
+			digest = image_store.digest(src)
+		except Exception:
+			app.logger.exception("fetching %s failed", src)
+	if digest is None:
+		# can't resize it, let the browser load the original
+		if image_store.allowed(src):
+			return redirect(src)
+		abort(404)
+	# the thumbnail behind a digest never changes, so it can be cached for good
+	etag = f"{digest[:32]}-{width}"
+	if etag in request.if_none_match:
+		response = Response(status=304)
+	else:
+		response = send_file(image_store.thumbnail(digest, width, fmt), mimetype=IMAGE_FORMATS[fmt])
+	response.set_etag(etag)
+	response.cache_control.public = True
+	response.cache_control.max_age = app.config.get("IMAGE_MAX_AGE", 31536000)
+	response.vary.add("Accept")
+	return response
+
+
+@app.route("/cache/stats")
+@query_budget(0)
+def cache_stats():
+	return jsonify(detail_cache.stats())
+
+
+@app.route("/admission/stats")
+@query_budget(0)
+def admission_stats():
+	return jsonify(admission.stats())
+
+
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+
+@app.route("/autocomplete")
+@query_budget(0)
+def autocomplete():
+	# top-k name completions served from the prefix indexes, no database round trip
+	prefix = request.args.get("q", "")
+	k = min(request.args.get("k", 10, type=int), 50)
+	kind = request.args.get("type")
+	response = {}
+	if kind in (None, "venues"):
+		response["venues"] = venue_index.complete(prefix, k)
+	if kind in (None, "artists"):
+		response["artists"] = artist_index.complete(prefix, k)
+	return jsonify(response)
+
+
 @app.errorhandler(404)
 def not_found_error(error):
 	return render_template("errors/404.html"), 404
@@ -918,6 +2465,255 @@ def server_error(error):
 	return render_template("errors/500.html"), 500
 
 
+# ----------------------------------------------------------------------------#
+# Commands.
+# ----------------------------------------------------------------------------#
+
+
+@app.cli.command("rebuild-read-model")
+def rebuild_read_model():
+	"""Rebuild every venue and artist read model document."""
+	venue_ids = [r[0] for r in db.session.query(Venue.id)]
+	artist_ids = [r[0] for r in db.session.query(Artist.id)]
+	ReadModel.query.delete()
+	refresh_documents(venue_ids=venue_ids, artist_ids=artist_ids)
+	db.session.commit()
+	detail_cache.clear()
+	click.echo(f"rebuilt {len(venue_ids)} venue and {len(artist_ids)} artist documents")
+
+
+@app.cli.command("ingest-images")
+def ingest_images():
+	"""Fetch every venue and artist image and render its thumbnails."""
+	urls = {r[0] for r in db.session.query(Venue.image_link).union(db.session.query(Artist.image_link)) if r[0]}
+	done = 0
+	for url in sorted(urls):
+		try:
+			digest = image_store.ingest(url)
+		except Exception as e:
+			click.echo(f"{url}: {e}", err=True)
+			continue
+		if digest is None:
+			click.echo(f"{url}: not in IMAGE_SOURCE_DIR and not from an allowed origin", err=True)
+			continue
+		done += 1
+	click.echo(f"{done} of {len(urls)} images ingested into {image_store.root}")
+
+
+# fingerprint of the rows behind each page `flask build-static` renders. a detail page changes
+# with its own row, its shows, the rows of the other side of those shows, the number of
+# shows still upcoming (which changes with the clock) and, for artists, the similar artists
+def static_page_stamps():
+	now = datetime.datetime.now()
+	upcoming = db.func.sum(db.case([(Show.start_time >= now, 1)], else_=0))
+	parts = {}
+	sides = (
+		("venues", Venue, Show.venue_id, Artist, Show.artist_id),
+		("artists", Artist, Show.artist_id, Venue, Show.venue_id),
+	)
+	for prefix, model, column, other, other_column in sides:
+		shows = {
+			r[0]: [r[1], str(r[2]), int(r[3] or 0), str(r[4])]
+			for r in db.session.query(
+				column,
+				db.func.count(Show.id),
+				db.func.max(Show.updated_at),
+				upcoming,
+				db.func.max(other.updated_at),
+			)
+			.join(other, other_column == other.id)
+			.group_by(column)
+		}
+		for entity_id, updated_at, version in db.session.query(model.id, model.updated_at, model.version):
+			parts[f"/{prefix}/{entity_id}"] = [str(updated_at), version] + shows.get(entity_id, [])
+	similar = (
+		db.session.query(
+			SimilarArtist.artist_id, SimilarArtist.similar_id, SimilarArtist.score, Artist.updated_at
+		)
+		.join(Artist, Artist.id == SimilarArtist.similar_id)
+		.order_by(SimilarArtist.artist_id, SimilarArtist.rank)
+	)
+	for artist_id, similar_id, score, updated_at in similar:
+		parts.get(f"/artists/{artist_id}", []).append([similar_id, round(score, 4), str(updated_at)])
+	stamps = {url: hashlib.sha1(json.dumps(p).encode()).hexdigest() for url, p in parts.items()}
+	# the listings change whenever any of their entries does
+	for prefix in ("venues", "artists"):
+		entries = sorted(
+			f"{url} {stamp}" for url, stamp in stamps.items() if url.startswith(f"/{prefix}/")
+		)
+		stamps[f"/{prefix}"] = hashlib.sha1("\n".join(entries).encode()).hexdigest()
+	return stamps
+
+
+@app.cli.command("build-static")
+@click.option("--out", default="site", show_default=True, help="directory to render into")
+@click.option("--full", is_flag=True, help="render every page, not just the changed ones")
+@click.option("--jobs", type=int, default=None, help="render processes, defaults to one per cpu")
+def build_static(out, full, jobs):
+	"""Render the venue and artist pages to static files."""
+	stamps = static_page_stamps()
+	db.session.close()
+	if not static_site.build(stamps, out, app.static_folder, jobs=jobs, full=full, log=click.echo):
+		raise SystemExit(1)
+
+
+@app.cli.command("import-geocodes")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def import_geocodes(path):
+	"""Load a CSV of address,city,state,latitude,longitude into the geocode table and place the venues.
+
+	Rows with an empty address are the city's own coordinates, used for venues whose address
+	isn't listed.
+	"""
+	with open(path, newline="") as f:
+		rows = {}
+		for row in csv.DictReader(f):
+			key = (geocode_key(row["state"]), geocode_key(row["city"]), geocode_key(row.get("address")))
+			rows[key] = {
+				"state": key[0],
+				"city": key[1],
+				"address": key[2],
+				"latitude": float(row["latitude"]),
+				"longitude": float(row["longitude"]),
+			}
+	existing = set(db.session.query(Geocode.state, Geocode.city, Geocode.address))
+	db.session.bulk_insert_mappings(Geocode, [r for k, r in rows.items() if k not in existing])
+	db.session.bulk_update_mappings(Geocode, [r for k, r in rows.items() if k in existing])
+	moved = locate_venues()
+	db.session.commit()
+	click.echo(f"{len(rows)} geocodes loaded, {len(moved)} venues placed")
+
+
+@app.cli.command("locate-venues")
+def locate_venues_command():
+	"""Set every venue's coordinates from the geocode table."""
+	moved = locate_venues()
+	db.session.commit()
+	click.echo(f"{len(moved)} venues placed, {Venue.query.filter(Venue.geohash.is_(None)).count()} without coordinates")
+
+
+@app.cli.command("outbox-consume")
+@click.argument("consumer")
+@click.option("--batch-size", default=100, show_default=True)
+@click.option("--follow", is_flag=True, help="keep waiting for new events")
+def outbox_consume(consumer, batch_size, follow):
+	"""Print the outbox events after CONSUMER's checkpoint as JSON lines and move it past them."""
+	def handler(events):
+		for e in events:
+			click.echo(json.dumps(e, default=str, sort_keys=True))
+
+	if follow:
+		change_outbox.run(consumer, handler, batch_size)
+	while change_outbox.consume(consumer, handler, batch_size):
+		pass
+
+
+@app.cli.command("outbox-status")
+def outbox_status():
+	"""Show each outbox consumer's checkpoint and how many events it's behind."""
+	for consumer, (position, behind) in change_outbox.status().items():
+		click.echo(f"{consumer}: at {position}, {behind} behind")
+	click.echo(f"{OutboxEvent.query.count()} events kept")
+
+
+@app.cli.command("outbox-prune")
+def outbox_prune():
+	"""Delete the outbox events every consumer has already handled."""
+	click.echo(f"{change_outbox.prune()} events pruned")
+
+
+@app.cli.command("compile-templates")
+def compile_templates():
+	"""Compile every template into TEMPLATE_CACHE_DIR, for a build step or a fresh deploy."""
+	if app.jinja_env.bytecode_cache is None:
+		raise click.ClickException("TEMPLATE_CACHE_DIR isn't set")
+	os.makedirs(app.config["TEMPLATE_CACHE_DIR"], exist_ok=True)
+	app.jinja_env.bytecode_cache.clear()
+	# the environment keeps compiled templates in memory too
+	app.jinja_env.cache.clear()
+	click.echo(f"{len(precompile_templates())} templates compiled into {app.config['TEMPLATE_CACHE_DIR']}")
+
+
+@app.cli.command("refresh-recommendations")
+@click.option("--batch-size", default=500, show_default=True)
+@click.option("--follow", is_flag=True, help="keep waiting for new changes")
+def refresh_recommendations_command(batch_size, follow):
+	"""Refresh similar artists and matches for the venues and artists changed since the last run."""
+	def handler(events):
+		venue_ids, artist_ids = recommendation_targets(events)
+		refresh_recommendations(venue_ids, artist_ids)
+		click.echo(f"{len(events)} changes, {'everything' if venue_ids is None else f'{len(venue_ids)} venues and {len(artist_ids)} artists'} refreshed")
+
+	if follow:
+		change_outbox.run("recommendations", handler, batch_size)
+	while change_outbox.consume("recommendations", handler, batch_size):
+		pass
+
+
+@app.cli.command("refresh-similar-artists")
+def refresh_similar_artists_command():
+	"""Recompute the similar artists table for every artist."""
+	refresh_similar_artists()
+	db.session.commit()
+	click.echo(f"{SimilarArtist.query.count()} similar artist rows")
+
+
+@app.cli.command("refresh-matches")
+def refresh_matches_command():
+	"""Rescore every seeking venue against every seeking artist."""
+	refresh_matches()
+	db.session.commit()
+	click.echo(f"{TalentMatch.query.count()} venue/artist matches")
+
+
+@app.cli.command("rebuild-analytics")
+def rebuild_analytics():
+	"""Recompute the analytics rollups from the show table."""
+	AnalyticsRollup.query.delete()
+	apply_rollup({}, show_facts())
+	db.session.commit()
+	click.echo(f"{AnalyticsRollup.query.count()} rollup rows")
+
+
+@app.cli.command("export")
+@click.option("--out", default="export", help="Directory the snapshot is written under.")
+@click.option("--format", "fmt", type=click.Choice(sorted(export.WRITERS)), help="Defaults to parquet when pyarrow is installed, jsonl otherwise.")
+@click.option("--incremental", is_flag=True, help="Only rows added or updated since the last export.")
+@click.option("--chunk-size", default=5000)
+def export_command(out, fmt, incremental, chunk_size):
+	"""Snapshot the catalog tables into compressed columnar files."""
+	# point EXPORT_DATABASE_URI at a replica to keep the reads off the primary
+	url = app.config.get("EXPORT_DATABASE_URI")
+	engine = db.create_engine(url, {}) if url else db.engine
+	tables = [db.metadata.tables[name] for name in ("Venue", "Artist", "show", "genre", "artist_genre", "venue_genre")]
+	export.export_tables(
+		engine, tables, out, fmt, incremental, chunk_size, app.config.get("EXPORT_OVERLAP", 600), log=click.echo
+	)
+
+
+@app.cli.command("check-read-model")
+def check_read_model():
+	"""Compare the stored read model documents with the live tables."""
+	live = {("venue", r[0]) for r in db.session.query(Venue.id)}
+	live |= {("artist", r[0]) for r in db.session.query(Artist.id)}
+	stored = {(r.entity, r.entity_id): r.document for r in ReadModel.query}
+	problems = 0
+	for key in sorted(live | set(stored)):
+		entity, entity_id = key
+		if key not in stored:
+			click.echo(f"missing {entity} {entity_id}")
+		elif key not in live:
+			click.echo(f"orphaned {entity} {entity_id}")
+		elif json.loads(stored[key]) != document_builders[entity](entity_id):
+			click.echo(f"stale {entity} {entity_id}")
+		else:
+			continue
+		problems += 1
+	click.echo(f"{problems} inconsistent documents out of {len(live)}")
+	if problems:
+		raise SystemExit(1)
+
+
 if not app.debug:
 	file_handler = FileHandler("error.log")
 	file_handler.setFormatter(
@@ -0,0 +1,84 @@
+"""Read route latency on each storage backend, for comparing SQLite with Postgres.
+
+Every database given is brought up to the same small catalog, then every read
+route of the query budget harness is requested --repeat times with the detail
+cache cleared, so the numbers are the database's and not the cache's. Prints
+the median and p95 per route and backend, and each backend's median relative
+to the first one.
+
+    python bench_storage.py sqlite:////tmp/fyyur.db postgresql://postgres@localhost/fyyur_bench
+
+Empty databases are seeded. A database that already has venues is used as it
+is, so point this at scratch databases, with matching data, only.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from query_budget import read_requests, seed
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def bench(fyyur, url, repeat, warmup=3):
+    fyyur.app.config["SQLALCHEMY_DATABASE_URI"] = url
+    with fyyur.app.app_context():
+        fyyur.db.create_all()
+        if not fyyur.Venue.query.count():
+            seed(fyyur)
+    client = fyyur.app.test_client()
+    results = {}
+    for endpoint, path, options in read_requests(fyyur):
+        timings = []
+        for i in range(warmup + repeat):
+            fyyur.detail_cache.clear()
+            started = time.perf_counter()
+            client.open(path, **options).get_data()
+            if i >= warmup:
+                timings.append((time.perf_counter() - started) * 1000)
+        results[endpoint] = {
+            "median_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(percentile(timings, 0.95), 3),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("databases", nargs="+", help="database urls, the first is the baseline")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--out", help="also write the results to this json file")
+    args = parser.parse_args(argv)
+
+    import app as fyyur
+
+    fyyur.app.config["TESTING"] = True
+    fyyur.admission.enabled = False
+    results = {url: bench(fyyur, url, args.repeat) for url in args.databases}
+
+    baseline = results[args.databases[0]]
+    names = [url.split(":", 1)[0] for url in args.databases]
+    print(f"{'route':<22}" + "".join(f"{name:>27}" for name in names))
+    for endpoint in baseline:
+        line = f"{endpoint:<22}"
+        for url in args.databases:
+            timing = results[url][endpoint]
+            ratio = timing["median_ms"] / baseline[endpoint]["median_ms"]
+            line += f"{timing['median_ms']:>9.2f} /{timing['p95_ms']:>7.2f} ms x{ratio:<5.2f}"
+        print(line)
+    for url in args.databases:
+        total = sum(timing["median_ms"] for timing in results[url].values())
+        print(f"{url}: {total:.2f} ms summed medians")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
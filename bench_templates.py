@@ -0,0 +1,184 @@
+"""Render time of the show tile pages at 10, 100 and 1000 tiles.
+
+Renders pages/shows.html, pages/show_venue.html and pages/show_artist.html
+with made up shows, each with its own start time, --repeat times per size.
+Prints the median and p95 per page and size, with the date cache cleared
+before every render (cold) and kept (warm). --legacy also times the tile
+loop the pages used before partials/tiles.html, which ran the thumb and
+datetime filters per tile, next to the macro with show_tiles(). Then the
+time to compile every template from source and to load it from the
+bytecode cache.
+
+    python bench_templates.py --sizes 10 100 1000 --repeat 20 --legacy
+"""
+import argparse
+import datetime
+import json
+import statistics
+import sys
+import tempfile
+import time
+
+from jinja2 import Environment, FileSystemBytecodeCache
+
+# the per tile markup of shows.html before it moved into a macro
+LEGACY_TILES = """{% for show in shows %}
+<div class="col-sm-4" data-show-id="{{ show.id }}" data-start="{{ show.start_time }}">
+    <div class="tile tile-show">
+        <img src="{{ show.artist_image_link|thumb }}" alt="Artist Image" />
+        <h4>{{ show.start_time|datetime('full') }}</h4>
+        <h5><a href="/artists/{{ show.artist_id }}">{{ show.artist_name }}</a></h5>
+        <p>playing at</p>
+        <h5><a href="/venues/{{ show.venue_id }}">{{ show.venue_name }}</a></h5>
+    </div>
+</div>
+{% endfor %}"""
+
+MACRO_TILES = """{% import 'partials/tiles.html' as tiles %}{{ tiles.show_grid(shows) }}"""
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def fake_shows(count, images=20):
+    start = datetime.datetime(2030, 1, 1, 20)
+    return [
+        {
+            "id": i,
+            "venue_id": i % 50,
+            "venue_name": f"Venue {i % 50}",
+            "venue_image_link": f"https://images.unsplash.com/venue-{i % images}.jpg",
+            "artist_id": i % 70,
+            "artist_name": f"Artist {i % 70}",
+            "artist_image_link": f"https://images.unsplash.com/artist-{i % images}.jpg",
+            "start_time": str(start + datetime.timedelta(hours=7 * i)),
+        }
+        for i in range(count)
+    ]
+
+
+def detail(shows, entity):
+    half = len(shows) // 2
+    payload = {
+        "id": 1,
+        "name": f"Some {entity}",
+        "genres": ["Jazz", "Folk"],
+        "city": "San Francisco",
+        "state": "CA",
+        "address": "1015 Folsom Street",
+        "phone": "123-123-1234",
+        "website": "https://example.com",
+        "facebook_link": "https://www.facebook.com/example",
+        "seeking_talent": True,
+        "seeking_venue": True,
+        "seeking_description": "Looking around",
+        "image_link": "https://images.unsplash.com/main.jpg",
+        "upcoming_shows": shows[:half],
+        "past_shows": shows[half:],
+    }
+    payload.update(upcoming_shows_count=half, past_shows_count=len(shows) - half)
+    return payload
+
+
+def timed(render, repeat, cold, fyyur):
+    timings = []
+    for _ in range(repeat):
+        if cold:
+            fyyur.format_datetime.cache_clear()
+        started = time.perf_counter()
+        render()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": round(statistics.median(timings), 3), "p95_ms": round(percentile(timings, 0.95), 3)}
+
+
+def pages(fyyur, shows):
+    # each page rendered the way its route renders it, tiles included
+    render = fyyur.render_template
+    return {
+        "pages/shows.html": lambda: render(
+            "pages/shows.html", shows=fyyur.show_tiles(shows), filters={}, genres=["Jazz", "Folk"]
+        ),
+        "pages/show_venue.html": lambda: render(
+            "pages/show_venue.html", venue=fyyur.detail_tiles(detail(shows, "venue"), "artist")
+        ),
+        "pages/show_artist.html": lambda: render(
+            "pages/show_artist.html",
+            artist=fyyur.detail_tiles(detail(shows, "artist"), "venue"),
+            similar_artists=[],
+        ),
+    }
+
+
+def compile_times(fyyur, repeat):
+    # a fresh environment per run, like a restarted worker
+    loader = fyyur.app.jinja_env.loader
+    names = fyyur.app.jinja_env.list_templates(extensions=["html"])
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for label, bytecode_cache in (
+            ("source", None),
+            ("bytecode cache", FileSystemBytecodeCache(cache_dir)),
+        ):
+            timings = []
+            for _ in range(repeat + 1):
+                env = Environment(loader=loader, bytecode_cache=bytecode_cache)
+                env.filters.update(fyyur.app.jinja_env.filters)
+                started = time.perf_counter()
+                for name in names:
+                    env.get_template(name)
+                timings.append((time.perf_counter() - started) * 1000)
+            # the first run only fills the cache
+            results[label] = round(statistics.median(timings[1:]), 3)
+    return len(names), results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--legacy", action="store_true", help="also time the old filter based tile loop")
+    parser.add_argument("--out", help="also write the results to this json file")
+    args = parser.parse_args(argv)
+
+    import app as fyyur
+
+    fyyur.app.config["TESTING"] = True
+    results = {}
+    with fyyur.app.test_request_context("/", headers={"Accept": "image/webp,*/*"}):
+        for size in args.sizes:
+            shows = fake_shows(size)
+            renders = pages(fyyur, shows)
+            if args.legacy:
+                legacy = fyyur.app.jinja_env.from_string(LEGACY_TILES)
+                macro = fyyur.app.jinja_env.from_string(MACRO_TILES)
+                renders["tiles, filters per tile"] = lambda: legacy.render(shows=shows)
+                renders["tiles, show_tiles + macro"] = lambda: macro.render(shows=fyyur.show_tiles(shows))
+            for name, render in renders.items():
+                render()
+                results.setdefault(name, {})[size] = {
+                    "cold": timed(render, args.repeat, True, fyyur),
+                    "warm": timed(render, args.repeat, False, fyyur),
+                }
+
+    print(f"{'template':<28}{'tiles':>6}{'cold median/p95 ms':>24}{'warm median/p95 ms':>24}")
+    for name, sizes in results.items():
+        for size, timing in sizes.items():
+            cold, warm = timing["cold"], timing["warm"]
+            print(
+                f"{name:<28}{size:>6}"
+                f"{cold['median_ms']:>13.2f} /{cold['p95_ms']:>8.2f}"
+                f"{warm['median_ms']:>15.2f} /{warm['p95_ms']:>8.2f}"
+            )
+    count, compiled = compile_times(fyyur, max(3, args.repeat // 4))
+    for label, ms in compiled.items():
+        print(f"{count} templates from {label}: {ms:.2f} ms")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"renders": results, "compile_ms": compiled}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
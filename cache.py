@@ -0,0 +1,115 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUBackend:
+    """Bounded in-process store, evicts the least recently used entry when full."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend:
+    """Shared store so every worker sees the same entries and invalidations."""
+
+    def __init__(self, url, prefix="fyyur:"):
+        # optional dependency, only needed when CACHE_BACKEND points at redis
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return (pickle.loads(raw), None)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class PayloadCache:
+    """Memoizes payload builders by key with a ttl and explicit invalidation."""
+
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_set(self, key, builder):
+        entry = self.backend.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        value = builder()
+        # missing rows are not cached, the next create would otherwise be hidden
+        if value is not None:
+            self.backend.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, *keys):
+        self.backend.delete(*keys)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+def cache_from_config(config):
+    backend = config.get("CACHE_BACKEND", "memory")
+    if backend == "memory":
+        store = LRUBackend(config.get("CACHE_MAX_ENTRIES", 1024))
+    else:
+        store = RedisBackend(backend)
+    return PayloadCache(store, config.get("CACHE_TTL", 60))
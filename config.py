@@ -24,6 +24,115 @@ if password:
     password = ':' + password
 
 #  IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = f'{dialect}://{username}{password}@{host}:{port}/{db_name}'
+# DATABASE_URL=sqlite:///fyyur.db runs on a local SQLite file instead of postgres
+SQLALCHEMY_DATABASE_URI = os.environ.get(
+    'DATABASE_URL', f'{dialect}://{username}{password}@{host}:{port}/{db_name}'
+)
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# SQLite mode, see storage.py. Readers is the size of the read-only connection pool for GET requests
+SQLITE_READERS = int(os.environ.get('SQLITE_READERS', 4))
+
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+SQLITE_CACHE_SIZE_KB = 64 * 1024
+
+# seconds a connection waits for the write lock before giving up
+SQLITE_BUSY_TIMEOUT = 5
+
+# Detail page cache, "memory" for a per-process LRU or a redis:// url to share it between workers
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+
+CACHE_TTL = 60
+
+CACHE_MAX_ENTRIES = 1024
+
+# Request profiling, writes pstats/collapsed stacks/summary per profiled request
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(basedir, 'profiles'))
+
+PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED') == '1'
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+
+# signs the X-Profile header, profiling by header is off when it's not set
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET')
+
+# longest a signed X-Profile token may stay valid, in seconds
+PROFILE_TOKEN_TTL = 300
+
+# How many similar artists to keep per artist
+SIMILAR_ARTISTS = 6
+
+# Venue/talent matchmaking, score = weighted genre overlap + same city + same state + past shows together
+MATCH_WEIGHTS = {'genre': 0.55, 'city': 0.25, 'state': 0.05, 'history': 0.15}
+
+MATCH_MIN_SCORE = 0.1
+
+# Database `flask export` reads from, a replica keeps the export off the primary
+EXPORT_DATABASE_URI = os.environ.get('EXPORT_DATABASE_URL')
+
+# seconds of updated_at an incremental export reads again, past the longest write transaction and any
+# clock skew between app servers. rows stamped in that window commit late and would be missed otherwise
+EXPORT_OVERLAP = 600
+
+# Admission control, per client token buckets (rate/s, burst) and per process concurrency slots
+# for each class of route. A request waits up to queue_timeout seconds for a slot, then gets a 503.
+# Clients are keyed on their address, so behind a reverse proxy set TRUSTED_PROXIES before turning it on
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '0') == '1'
+
+# how many reverse proxies in front of the app set X-Forwarded-For, 0 when clients connect directly
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+ADMISSION_LIMITS = {
+    'read': {'rate': 20, 'burst': 40, 'concurrency': 32, 'queue_timeout': 0.5},
+    'search': {'rate': 2, 'burst': 6, 'concurrency': 4, 'queue_timeout': 0.25},
+    'write': {'rate': 1, 'burst': 5, 'concurrency': 4, 'queue_timeout': 0.25},
+}
+
+# slots of their own for the heaviest routes, taken on top of their class's
+ADMISSION_ROUTE_LIMITS = {
+    'analytics': {'concurrency': 2},
+    'analytics_json': {'concurrency': 2},
+    'show_genre': {'concurrency': 8},
+    'city_feed': {'concurrency': 4},
+}
+
+# "memory" keeps the buckets per process, a redis:// url shares them between workers
+ADMISSION_STORE = os.environ.get('ADMISSION_STORE', 'memory')
+
+# endpoints left out, a long-lived stream would hold its slot for as long as it's open
+ADMISSION_EXEMPT = ['show_stream']
+
+# Thumbnails of image_link pictures, a content addressed disk cache served from /thumbs
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', os.path.join(basedir, 'image-cache'))
+
+# local copies of the sources, looked up by the url's file name before going to the network
+IMAGE_SOURCE_DIR = os.environ.get('IMAGE_SOURCE_DIR')
+
+# hosts thumbnails may be fetched from, anything else is linked as is
+IMAGE_ALLOWED_ORIGINS = ['images.unsplash.com']
+
+IMAGE_WIDTHS = [400, 800]
+
+IMAGE_MAX_AGE = 60 * 60 * 24 * 365
+
+# /shows/stream, seconds between keep-alive comments and events buffered per client before it's told to reload
+LIVE_HEARTBEAT = 15
+
+LIVE_QUEUE_SIZE = 100
+
+# on databases other than sqlite and postgres, where open writers can't be seen, outbox consumers wait this
+# many seconds for a gap in the event ids to fill. a write transaction still open after this long has its events skipped
+OUTBOX_SETTLE = 300
+
+# compiled Jinja templates, kept across restarts. set TEMPLATE_CACHE_DIR empty to compile in memory only
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(basedir, 'template-cache'))
+
+# compile every template before a worker's first request instead of on each one's first render
+TEMPLATE_PRECOMPILE = os.environ.get('TEMPLATE_PRECOMPILE', '0') == '1'
+
+# /venues/nearby and /shows/nearby, the widest radius in km a search may cover and the most shows one returns
+GEO_MAX_RADIUS_KM = 100
+
+GEO_MAX_SHOWS = 500
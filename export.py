@@ -0,0 +1,188 @@
+import datetime
+import gzip
+import json
+import os
+
+import sqlalchemy as sa
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # the jsonl writer needs nothing beyond the standard library
+    pa = None
+
+MANIFEST = "manifest.json"
+
+
+def _arrow_type(column):
+    if isinstance(column.type, sa.Boolean):
+        return pa.bool_()
+    if isinstance(column.type, sa.Integer):
+        return pa.int64()
+    if isinstance(column.type, sa.Float):
+        return pa.float64()
+    if isinstance(column.type, sa.DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+class JsonlWriter:
+    extension = "jsonl.gz"
+
+    def __init__(self, path, table):
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write(json.dumps(row, default=str) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    extension = "parquet"
+
+    def __init__(self, path, table):
+        self.schema = pa.schema([(c.name, _arrow_type(c)) for c in table.columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        # one row group per chunk
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class ArrowWriter(ParquetWriter):
+    extension = "arrow"
+
+    def __init__(self, path, table):
+        self.schema = pa.schema([(c.name, _arrow_type(c)) for c in table.columns])
+        self.sink = pa.OSFile(path, "wb")
+        self.writer = pa.ipc.new_file(
+            self.sink, self.schema, options=pa.ipc.IpcWriteOptions(compression="zstd")
+        )
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+WRITERS = {"parquet": ParquetWriter, "arrow": ArrowWriter, "jsonl": JsonlWriter}
+
+
+def default_format():
+    return "parquet" if pa is not None else "jsonl"
+
+
+def chunks(engine, table, chunk_size, since=None, overlap=0):
+    """Yields the rows of table as lists of dicts, chunk_size at a time.
+
+    Pages by primary key (keyset, not offset) and runs every page in its own
+    short connection, so no transaction stays open for the whole export.
+    since is the manifest entry of the previous run: only rows with a higher
+    id, or an updated_at no more than overlap seconds before the newest it
+    saw, are read. updated_at is stamped when a row is flushed, not when it
+    commits, so a row can commit after a later stamped one was exported;
+    the overlap reads it anyway.
+    """
+    pk = list(table.primary_key.columns)
+    query = sa.select([table]).order_by(*pk).limit(chunk_size)
+    if since:
+        changed = pk[0] > since["last_id"]
+        if since.get("last_updated"):
+            start = datetime.datetime.fromisoformat(since["last_updated"])
+            changed = sa.or_(changed, table.c.updated_at > start - datetime.timedelta(seconds=overlap))
+        query = query.where(changed)
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            page = page.where(sa.tuple_(*pk) > sa.tuple_(*last))
+        with engine.connect() as conn:
+            rows = [dict(row) for row in conn.execute(page)]
+        if not rows:
+            return
+        yield rows
+        last = [rows[-1][c.name] for c in pk]
+        if len(rows) < chunk_size:
+            return
+
+
+def _stamp(row):
+    return row["updated_at"].isoformat() if row["updated_at"] else None
+
+
+def export_tables(
+    engine, tables, out, fmt=None, incremental=False, chunk_size=5000, overlap=600, log=print
+):
+    """Writes each table to a new run directory under out and records where it got to in the manifest.
+
+    An incremental run only writes rows changed since the previous one. It
+    rereads the last overlap seconds of updated_at, and skips the rows it
+    finds there that the previous run already wrote with the same
+    updated_at, so a row is written again only when it changed. Tables
+    without a single id and an updated_at column are written in full.
+    """
+    fmt = fmt or default_format()
+    if fmt != "jsonl" and pa is None:
+        raise RuntimeError(f"{fmt} export needs pyarrow, use --format jsonl")
+    manifest_path = os.path.join(out, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    run = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+    directory = os.path.join(out, run)
+    os.makedirs(directory, exist_ok=True)
+    state = {}
+    for table in tables:
+        tracked = len(table.primary_key.columns) == 1 and "updated_at" in table.c
+        since = manifest.get("tables", {}).get(table.name) if incremental else None
+        # association tables and genres have nothing to resume from, they are small enough to resend
+        if not tracked:
+            since = None
+        writer_class = WRITERS[fmt]
+        path = os.path.join(directory, f"{table.name}.{writer_class.extension}")
+        writer = writer_class(path, table)
+        count = 0
+        entry = dict(since or {"last_id": 0, "last_updated": None})
+        # id -> updated_at of the rows written within overlap of the newest, the next run skips them
+        written = dict(since.get("recent", {})) if since else {}
+        recent = {}
+        try:
+            for rows in chunks(engine, table, chunk_size, since, overlap):
+                if tracked:
+                    key = list(table.primary_key.columns)[0].name
+                    fresh = [r for r in rows if written.get(str(r[key])) != _stamp(r)]
+                    entry["last_id"] = max(entry["last_id"], max(r[key] for r in rows))
+                    newest = max((r["updated_at"] for r in rows if r["updated_at"]), default=None)
+                    if newest and (
+                        not entry["last_updated"] or newest.isoformat() > entry["last_updated"]
+                    ):
+                        entry["last_updated"] = newest.isoformat()
+                    if entry["last_updated"]:
+                        cutoff = datetime.datetime.fromisoformat(entry["last_updated"])
+                        cutoff -= datetime.timedelta(seconds=overlap)
+                        recent.update((str(r[key]), _stamp(r)) for r in rows if r["updated_at"])
+                        recent = {
+                            id: stamp
+                            for id, stamp in recent.items()
+                            if datetime.datetime.fromisoformat(stamp) > cutoff
+                        }
+                    rows = fresh
+                if rows:
+                    writer.write(rows)
+                    count += len(rows)
+        finally:
+            writer.close()
+        if tracked:
+            entry["recent"] = recent
+        state[table.name] = entry
+        log(f"{table.name}: {count} rows -> {path}")
+    manifest = {"last_run": run, "format": fmt, "tables": state}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return directory
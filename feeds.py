@@ -0,0 +1,96 @@
+import csv
+import datetime
+import io
+
+# rows passed to these generators need: id, start_time, artist_id, artist_name,
+# venue_id, venue_name, address, city, state
+
+CSV_COLUMNS = [
+    "show_id",
+    "start_time",
+    "artist_id",
+    "artist_name",
+    "venue_id",
+    "venue_name",
+    "address",
+    "city",
+    "state",
+]
+
+
+def _escape(text):
+    # RFC 5545 text escaping
+    return (
+        str(text or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _fold(line):
+    # content lines longer than 75 octets continue on the next line after a space
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    while len(encoded) > 75:
+        cut = 75 if not parts else 74
+        # don't split a multi-byte character
+        while cut and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+    parts.append(encoded.decode("utf-8"))
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def ical(rows, name, host="fyyur"):
+    """Yields an iCalendar document one event at a time."""
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Fyyur//Shows//EN\r\n"
+    yield _fold(f"X-WR-CALNAME:{_escape(name)}")
+    for row in rows:
+        location = ", ".join(p for p in (row.venue_name, row.address, row.city, row.state) if p)
+        yield (
+            "BEGIN:VEVENT\r\n"
+            + _fold(f"UID:show-{row.id}@{host}")
+            + f"DTSTAMP:{stamp}\r\n"
+            + f"DTSTART:{row.start_time.strftime('%Y%m%dT%H%M%S')}\r\n"
+            + _fold(f"SUMMARY:{_escape(row.artist_name)} at {_escape(row.venue_name)}")
+            + _fold(f"LOCATION:{_escape(location)}")
+            + "END:VEVENT\r\n"
+        )
+    yield "END:VCALENDAR\r\n"
+
+
+def csv_rows(rows):
+    """Yields a csv document, header first, one line per show."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(CSV_COLUMNS)
+    yield flush()
+    for row in rows:
+        writer.writerow(
+            [
+                row.id,
+                row.start_time.isoformat(),
+                row.artist_id,
+                row.artist_name,
+                row.venue_id,
+                row.venue_name,
+                row.address,
+                row.city,
+                row.state,
+            ]
+        )
+        yield flush()
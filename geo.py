@@ -0,0 +1,146 @@
+import math
+
+from sqlalchemy import and_, or_
+
+# geohash's base32, in the order its cells sort
+ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode(lat, lng, precision=12):
+    """The geohash of a point, precision characters long."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        span, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        middle = (span[0] + span[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            span[0] = middle
+        else:
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def bounds(geohash):
+    # (south, north, west, east) of a cell
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            span = lng_range if even else lat_range
+            middle = (span[0] + span[1]) / 2
+            if value >> shift & 1:
+                span[0] = middle
+            else:
+                span[1] = middle
+            even = not even
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    # haversine, close enough for "near me" at any distance
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cell_size_km(precision, lat):
+    # height and width of a cell at precision, near latitude lat
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    height = 180.0 / 2**lat_bits * KM_PER_DEGREE
+    width = 360.0 / 2**lng_bits * KM_PER_DEGREE * math.cos(math.radians(min(abs(lat), 89.9)))
+    return height, width
+
+
+def precision_for(radius_km, lat):
+    # the finest precision whose cells are at least radius_km across, 0 when none is.
+    # cells narrow towards the poles, so the width is taken at the circle's poleward edge
+    edge = abs(lat) + radius_km / KM_PER_DEGREE
+    for precision in range(12, 0, -1):
+        if min(cell_size_km(precision, edge)) >= radius_km:
+            return precision
+    return 0
+
+
+def covering(lat, lng, radius_km):
+    """Cells that together contain every point within radius_km of (lat, lng).
+
+    The point's own cell at the finest precision still as wide as the radius,
+    and its eight neighbours. An empty prefix, the whole world, for a radius
+    wider than the coarsest cells.
+    """
+    precision = precision_for(radius_km, lat)
+    if not precision:
+        return [""]
+    south, north, west, east = bounds(encode(lat, lng, precision))
+    height, width = north - south, east - west
+    middle_lat, middle_lng = (south + north) / 2, (west + east) / 2
+    cells = set()
+    for d_lat in (-height, 0, height):
+        cell_lat = middle_lat + d_lat
+        if not -90 < cell_lat < 90:
+            continue
+        for d_lng in (-width, 0, width):
+            cell_lng = (middle_lng + d_lng + 180) % 360 - 180
+            cells.add(encode(cell_lat, cell_lng, precision))
+    return sorted(cells)
+
+
+def prefix_range(prefix):
+    # [low, high) holding every geohash that starts with prefix, high is None for no bound
+    for i in range(len(prefix) - 1, -1, -1):
+        position = ALPHABET.index(prefix[i])
+        if position + 1 < len(ALPHABET):
+            return prefix, prefix[:i] + ALPHABET[position + 1]
+    return prefix, None
+
+
+def cell_filter(column, cells):
+    """SQL criterion for rows whose geohash column falls in any of cells.
+
+    Range comparisons rather than LIKE, so a plain btree index on the column
+    serves them on any database whose collation sorts digits before lower
+    case letters, as C and the usual locales do.
+    """
+    clauses = []
+    for cell in cells:
+        low, high = prefix_range(cell) if cell else ("", None)
+        clauses.append(column >= low if high is None else and_(column >= low, column < high))
+    return or_(*clauses)
+
+
+def within(rows, lat, lng, radius_km):
+    # (distance, row) for rows with .latitude and .longitude within radius_km, nearest first
+    found = []
+    for row in rows:
+        distance = distance_km(lat, lng, row.latitude, row.longitude)
+        if distance <= radius_km:
+            found.append((distance, row))
+    found.sort(key=lambda pair: pair[0])
+    return found
+
+
+def nearest(search, lat, lng, k, max_radius_km, start_km=2.0):
+    """The k rows nearest (lat, lng), at most max_radius_km away, nearest first.
+
+    search(cells) runs the query for the rows in those cells. The radius
+    starts at start_km and grows fourfold until k rows are inside it, so a
+    dense area costs one query and an empty one a few, each reading only the
+    cells around the point.
+    """
+    radius = min(start_km, max_radius_km)
+    while True:
+        found = within(search(covering(lat, lng, radius)), lat, lng, radius)
+        if len(found) >= k or radius >= max_radius_km:
+            return found[:k]
+        radius = min(radius * 4, max_radius_km)
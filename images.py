@@ -0,0 +1,123 @@
+import hashlib
+import io
+import os
+import tempfile
+import urllib.parse
+import urllib.request
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow pages keep linking the original images
+    Image = None
+
+FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def source_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class ImageStore:
+    """Content addressed disk cache of source images and their thumbnails.
+
+    Sources are stored under blobs/ by the sha256 of their bytes, and refs/
+    maps the sha256 of an image_link to that digest. Thumbnails are named
+    after the source digest, width and format, so an image shared by several
+    venues is fetched and resized once, and a thumbnail file never changes.
+
+    Sources are read from source_dir when it has a file named like the last
+    path segment of the url (or like its source_key), and otherwise fetched
+    over http from one of allowed_origins.
+    """
+
+    def __init__(self, root, source_dir=None, allowed_origins=(), widths=(300,), max_bytes=10 << 20):
+        self.root = root
+        self.source_dir = source_dir
+        self.allowed_origins = set(allowed_origins)
+        self.widths = tuple(widths)
+        self.max_bytes = max_bytes
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def _path(self, sub, name):
+        return os.path.join(self.root, sub, name[:2], name)
+
+    def _write(self, path, data):
+        # write then rename, so a concurrent reader never sees half a file. the temp file is unique
+        # per call, two threads rendering the same thumbnail each rename their own complete copy
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(temp, 0o644)
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+    def allowed(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        return parsed.scheme in ("http", "https") and parsed.netloc in self.allowed_origins
+
+    def _fetch(self, url):
+        if self.source_dir:
+            name = os.path.basename(urllib.parse.urlsplit(url).path)
+            for candidate in (name, source_key(url)):
+                path = os.path.join(self.source_dir, candidate)
+                if candidate and os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        return f.read()
+        if not self.allowed(url):
+            return None
+        with urllib.request.urlopen(url, timeout=10) as response:
+            data = response.read(self.max_bytes + 1)
+        if len(data) > self.max_bytes:
+            return None
+        return data
+
+    def digest(self, url, fetch=True):
+        """sha256 of the source behind url, ingesting it first when fetch is set."""
+        ref = self._path("refs", source_key(url))
+        if os.path.exists(ref):
+            with open(ref) as f:
+                return f.read().strip()
+        if not fetch:
+            return None
+        data = self._fetch(url)
+        if not data:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self._path("blobs", digest)
+        if not os.path.exists(blob):
+            self._write(blob, data)
+        self._write(ref, digest.encode())
+        return digest
+
+    def thumbnail(self, digest, width, fmt):
+        """Path of the width pixel wide thumbnail of a stored source, made on first use."""
+        path = self._path("thumbs", f"{digest}-{width}.{fmt}")
+        if os.path.exists(path):
+            return path
+        with Image.open(self._path("blobs", digest)) as image:
+            image = image.convert("RGB")
+            if image.width > width:
+                image.thumbnail((width, max(1, width * image.height // image.width)), Image.LANCZOS)
+            out = io.BytesIO()
+            options = {"method": 4} if fmt == "webp" else {"optimize": True, "progressive": True}
+            image.save(out, fmt.upper(), quality=80, **options)
+        self._write(path, out.getvalue())
+        return path
+
+    def ingest(self, url, formats=tuple(FORMATS)):
+        # fetch url and render every configured thumbnail of it, returns the digest or None
+        digest = self.digest(url)
+        if digest is None:
+            return None
+        for width in self.widths:
+            for fmt in formats:
+                self.thumbnail(digest, width, fmt)
+        return digest
@@ -0,0 +1,204 @@
+import collections
+import json
+import queue
+import select
+import threading
+import time
+import uuid
+
+from sqlalchemy import event, text
+
+CHANNEL = "fyyur_shows"
+
+
+def matches(filters, show):
+    # the /shows filters: venue_id, artist_id, state (upper case), city (lower case),
+    # genre, and start / end as iso strings
+    if filters.get("venue_id") and show["venue_id"] != filters["venue_id"]:
+        return False
+    if filters.get("artist_id") and show["artist_id"] != filters["artist_id"]:
+        return False
+    if filters.get("state") and (show["state"] or "").upper() != filters["state"]:
+        return False
+    if filters.get("city") and (show["city"] or "").lower() != filters["city"]:
+        return False
+    if filters.get("genre") and filters["genre"] not in show["genres"]:
+        return False
+    if filters.get("start") and show["start_time"] < filters["start"]:
+        return False
+    if filters.get("end") and show["start_time"] >= filters["end"]:
+        return False
+    return True
+
+
+class Subscription:
+    def __init__(self, filters, size):
+        self.filters = filters
+        self.queue = queue.Queue(size)
+        # set when the client fell too far behind, it has to reload instead
+        self.overflowed = False
+
+
+class Broadcaster:
+    """Fans show events out to the subscribers in this process.
+
+    Each subscriber is a filter and a small bounded queue, so an idle stream
+    costs a queue and whatever the server keeps per open connection. A
+    subscriber whose queue fills up is told to reload rather than buffering
+    without bound. The last history events are kept so a client reconnecting
+    with Last-Event-ID gets what it missed.
+    """
+
+    def __init__(self, queue_size=100, history=256):
+        self.queue_size = queue_size
+        # event ids are only meaningful to the process that issued them
+        self.token = uuid.uuid4().hex[:8]
+        self.sequence = 0
+        self.history = collections.deque(maxlen=history)
+        self.subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, filters, last_event_id=None):
+        subscription = Subscription(filters, self.queue_size)
+        with self._lock:
+            self.subscribers.add(subscription)
+            if last_event_id:
+                missed = self._since(last_event_id)
+                if missed is None:
+                    subscription.overflowed = True
+                for item in missed or ():
+                    if matches(filters, item[1]["show"]):
+                        subscription.queue.put_nowait(item)
+        return subscription
+
+    def _since(self, last_event_id):
+        # events after last_event_id, None when they're no longer (or never were) here
+        token, _, number = last_event_id.partition("-")
+        if token != self.token or not number.isdigit():
+            return None
+        number = int(number)
+        if self.history and number < self.history[0][0] - 1:
+            return None
+        return [item for item in self.history if item[0] > number]
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, payload):
+        with self._lock:
+            self.sequence += 1
+            item = (self.sequence, payload)
+            self.history.append(item)
+            for subscription in self.subscribers:
+                if subscription.overflowed or not matches(subscription.filters, payload["show"]):
+                    continue
+                try:
+                    subscription.queue.put_nowait(item)
+                except queue.Full:
+                    subscription.overflowed = True
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": len(self.subscribers), "published": self.sequence}
+
+
+def sse(subscription, broadcaster, heartbeat=15):
+    """Yields the text/event-stream for a subscription until the client goes away."""
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            if subscription.overflowed:
+                yield "event: reload\ndata: {}\n\n"
+                return
+            try:
+                number, payload = subscription.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                # keeps proxies from closing the connection and finds clients that left
+                yield ": ping\n\n"
+                continue
+            yield (
+                f"id: {broadcaster.token}-{number}\n"
+                f"event: {payload['type']}\n"
+                f"data: {json.dumps(payload, default=str)}\n\n"
+            )
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+class LiveShows:
+    """Delivers show events to the broadcaster of every process once their transaction commits.
+
+    On postgres announce() issues pg_notify inside the writing transaction and
+    a listener thread per process LISTENs on the channel, so every worker hears
+    about every commit and nothing is sent for a rollback. On other databases
+    the events wait in the session until commit and are published to this
+    process only.
+    """
+
+    def __init__(self, db, broadcaster):
+        self.db = db
+        self.broadcaster = broadcaster
+        self._listener = None
+        self._lock = threading.Lock()
+        event.listen(db.session, "after_commit", self._after_commit)
+        event.listen(db.session, "after_soft_rollback", self._after_rollback)
+
+    def postgres(self):
+        return self.db.engine.dialect.name == "postgresql"
+
+    def announce(self, kind, shows):
+        # kind is created, updated or cancelled, shows are dicts from show_events in app.py
+        session = self.db.session()
+        for show in shows:
+            payload = {"type": kind, "show": show}
+            if self.postgres():
+                session.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": CHANNEL, "payload": json.dumps(payload, default=str)},
+                )
+            else:
+                session.info.setdefault("live_shows", []).append(payload)
+
+    def _after_commit(self, session):
+        for payload in session.info.pop("live_shows", ()):
+            self.broadcaster.publish(payload)
+
+    def _after_rollback(self, session, previous_transaction):
+        session.info.pop("live_shows", None)
+
+    def start(self):
+        # idempotent, the first stream request of a postgres backed process starts the listener
+        if not self.postgres():
+            return
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            connection = None
+            try:
+                raw = self.db.engine.raw_connection()
+                # a connection of its own for good, LISTEN is per connection
+                raw.detach()
+                connection = raw.connection
+                connection.set_isolation_level(0)
+                cursor = connection.cursor()
+                cursor.execute(f"LISTEN {CHANNEL}")
+                while True:
+                    if select.select([connection], [], [], 30) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        self.broadcaster.publish(json.loads(notify.payload))
+            except Exception:
+                # the database went away, listen again once it's back
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                time.sleep(5)
@@ -0,0 +1,409 @@
+"""Mixed workload load generator for a running instance, with per route latency percentiles.
+
+Replays a weighted mix of the app's routes over HTTP: the listings, venue and
+artist pages, the searches, /shows and the create and edit form posts. Venue
+and artist ids are read off /venues and /artists before the run.
+
+Arrival models:
+
+* closed: --clients clients, each sending its next request as soon as the
+  last one answered (plus --think seconds). Throughput is whatever the app
+  sustains at that concurrency.
+* open: requests arrive at --rate per second on a Poisson schedule, however
+  slowly the app answers, with at most --clients in flight. Latency is taken
+  from when a request was due, not when a client got to send it, so queueing
+  behind a slow app counts.
+
+Prints requests, errors, throughput and p50/p95/p99 per route, and writes the
+same as JSON with --out. `diff` compares two such files and exits non-zero
+when a route got slower or lost throughput beyond --threshold.
+
+    python loadgen.py run --url http://127.0.0.1:5000 --model closed --clients 32 --duration 60 --out before.json
+    python loadgen.py run --model open --rate 200 --mix venues=5,shows=5,create_venue=0 --out after.json
+    python loadgen.py diff before.json after.json
+
+The create and edit steps write made up venues and artists, so point it at a
+scratch database. Leave admission control off (ADMISSION_ENABLED=0, the
+default), or its limits answer most of the load with 429s, which are
+counted as errors.
+"""
+import argparse
+import collections
+import http.client
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# name -> (method, path, form), {venue_id}, {artist_id}, {term} and {n} are filled in per request
+ROUTES = {
+    "home": ("GET", "/", None),
+    "venues": ("GET", "/venues", None),
+    "artists": ("GET", "/artists", None),
+    "venue_detail": ("GET", "/venues/{venue_id}", None),
+    "artist_detail": ("GET", "/artists/{artist_id}", None),
+    "shows": ("GET", "/shows", None),
+    "search": ("GET", "/search?search_term={term}", None),
+    "search_venues": ("POST", "/venues/search", {"search_term": "{term}"}),
+    "search_artists": ("POST", "/artists/search", {"search_term": "{term}"}),
+    "create_venue": (
+        "POST",
+        "/venues/create",
+        {
+            "name": "Load Venue {n}",
+            "city": "San Francisco",
+            "state": "CA",
+            "address": "{n} Market St",
+            "phone": "555-000-0000",
+            "facebook_link": "https://www.facebook.com/load",
+            "genres": "Jazz",
+        },
+    ),
+    "create_artist": (
+        "POST",
+        "/artists/create",
+        {
+            "name": "Load Artist {n}",
+            "city": "San Francisco",
+            "state": "CA",
+            "phone": "555-000-0000",
+            "facebook_link": "https://www.facebook.com/load",
+            "genres": "Jazz",
+        },
+    ),
+    "edit_venue": (
+        "POST",
+        "/venues/{venue_id}/edit",
+        {
+            "name": "Load Venue {venue_id}",
+            "city": "San Francisco",
+            "state": "CA",
+            "phone": "555-{n}",
+            "facebook_link": "https://www.facebook.com/load",
+            "genres": "Jazz",
+        },
+    ),
+    "edit_artist": (
+        "POST",
+        "/artists/{artist_id}/edit",
+        {
+            "name": "Load Artist {artist_id}",
+            "city": "San Francisco",
+            "state": "CA",
+            "phone": "555-{n}",
+            "facebook_link": "https://www.facebook.com/load",
+            "genres": "Jazz",
+        },
+    ),
+}
+
+# roughly a browsing public: mostly page views, some searches, a few writes
+DEFAULT_MIX = {
+    "home": 5,
+    "venues": 15,
+    "artists": 10,
+    "venue_detail": 20,
+    "artist_detail": 20,
+    "shows": 12,
+    "search": 6,
+    "search_venues": 3,
+    "search_artists": 3,
+    "create_venue": 1,
+    "create_artist": 1,
+    "edit_venue": 2,
+    "edit_artist": 2,
+}
+
+SEARCH_TERMS = ["a", "the", "band", "music", "jazz", "park", "hop", "sax", "blue", "live"]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def parse_mix(value):
+    # "venues=5,shows=2" on top of the default mix, or a json file of name -> weight
+    if not value:
+        return dict(DEFAULT_MIX)
+    if value.endswith(".json"):
+        with open(value) as f:
+            mix = json.load(f)
+    else:
+        mix = dict(DEFAULT_MIX)
+        for part in value.split(","):
+            name, _, weight = part.partition("=")
+            mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(ROUTES)
+    if unknown:
+        raise SystemExit(f"unknown routes in the mix: {', '.join(sorted(unknown))}")
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+class Target:
+    """The instance under test: one keep-alive connection per thread, and the ids to request."""
+
+    def __init__(self, url, timeout=30):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.timeout = timeout
+        self.local = threading.local()
+        self.venue_ids, self.artist_ids = [], []
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def connection(self):
+        if getattr(self.local, "connection", None) is None:
+            self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self.local.connection
+
+    def request(self, method, path, form=None):
+        """Sends one request and returns its status, 0 when the connection failed."""
+        body, headers = None, {}
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        for attempt in (1, 2):
+            connection = self.connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.getheader("Connection", "").lower() == "close":
+                    connection.close()
+                    self.local.connection = None
+                return response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                self.local.connection = None
+                # a kept-alive connection the server already closed gets one retry
+                if attempt == 2:
+                    return 0
+
+    def discover(self):
+        for path, pattern, ids in (
+            ("/venues", r'href="/venues/(\d+)"', self.venue_ids),
+            ("/artists", r'href="/artists/(\d+)"', self.artist_ids),
+        ):
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            connection.request("GET", path)
+            page = connection.getresponse().read().decode("utf8", "replace")
+            connection.close()
+            ids.extend(sorted({int(i) for i in re.findall(pattern, page)}))
+        if not self.venue_ids or not self.artist_ids:
+            raise SystemExit("no venues or artists found on /venues and /artists, seed the database first")
+
+    def fill(self, name):
+        # the method, path and form of one request for route name, with fresh values
+        method, path, form = ROUTES[name]
+        with self.lock:
+            self.counter += 1
+            n = self.counter
+        values = {
+            "venue_id": random.choice(self.venue_ids),
+            "artist_id": random.choice(self.artist_ids),
+            "term": urllib.parse.quote(random.choice(SEARCH_TERMS)),
+            "n": n,
+        }
+        path = path.format(**values)
+        if form is not None:
+            values["term"] = urllib.parse.unquote(values["term"])
+            form = {key: value.format(**values) for key, value in form.items()}
+        return method, path, form
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.statuses = collections.defaultdict(collections.Counter)
+        self.lock = threading.Lock()
+
+    def add(self, name, status, seconds):
+        with self.lock:
+            self.latencies[name].append(seconds * 1000)
+            self.statuses[name][status] += 1
+
+    def summary(self, elapsed):
+        def stats(latencies, statuses):
+            errors = sum(count for status, count in statuses.items() if not 200 <= status < 400)
+            return {
+                "requests": len(latencies),
+                "errors": errors,
+                "throughput_rps": round(len(latencies) / elapsed, 3),
+                "p50_ms": round(percentile(latencies, 0.50), 3),
+                "p95_ms": round(percentile(latencies, 0.95), 3),
+                "p99_ms": round(percentile(latencies, 0.99), 3),
+                "max_ms": round(max(latencies), 3),
+                "statuses": {str(status): count for status, count in sorted(statuses.items())},
+            }
+
+        routes = {
+            name: stats(self.latencies[name], self.statuses[name]) for name in sorted(self.latencies)
+        }
+        everything = [ms for latencies in self.latencies.values() for ms in latencies]
+        total = collections.Counter()
+        for statuses in self.statuses.values():
+            total.update(statuses)
+        return routes, stats(everything, total) if everything else None
+
+
+def run_closed(target, mix, recorder, clients, duration, think):
+    names, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            method, path, form = target.fill(name)
+            started = time.perf_counter()
+            status = target.request(method, path, form)
+            recorder.add(name, status, time.perf_counter() - started)
+            if think:
+                time.sleep(random.expovariate(1 / think))
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open(target, mix, recorder, clients, duration, rate):
+    names, weights = list(mix), list(mix.values())
+
+    def send(name, due):
+        method, path, form = target.fill(name)
+        status = target.request(method, path, form)
+        recorder.add(name, status, time.perf_counter() - due)
+
+    started = time.perf_counter()
+    due = started
+    with ThreadPoolExecutor(clients) as pool:
+        while True:
+            due += random.expovariate(rate)
+            if due - started >= duration:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, random.choices(names, weights)[0], due)
+
+
+def print_report(routes, overall):
+    print(f"{'route':<16}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in list(routes.items()) + [("all", overall)]:
+        print(
+            f"{name:<16}{row['requests']:>9}{row['errors']:>8}{row['throughput_rps']:>9.1f}"
+            f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+        )
+
+
+def run(args):
+    target = Target(args.url, args.timeout)
+    mix = parse_mix(args.mix)
+    target.discover()
+    recorder = Recorder()
+    started = time.perf_counter()
+    if args.model == "closed":
+        run_closed(target, mix, recorder, args.clients, args.duration, args.think)
+    else:
+        run_open(target, mix, recorder, args.clients, args.duration, args.rate)
+    elapsed = time.perf_counter() - started
+    routes, overall = recorder.summary(elapsed)
+    if overall is None:
+        print("no requests were sent")
+        return 1
+    print_report(routes, overall)
+    if args.out:
+        result = {
+            "config": {
+                "url": args.url,
+                "model": args.model,
+                "clients": args.clients,
+                "rate": args.rate if args.model == "open" else None,
+                "think": args.think if args.model == "closed" else None,
+                "duration": args.duration,
+                "mix": mix,
+                "venues": len(target.venue_ids),
+                "artists": len(target.artist_ids),
+            },
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "elapsed_s": round(elapsed, 3),
+            "overall": overall,
+            "routes": routes,
+        }
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    return 0
+
+
+def diff(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before["config"]["model"] != after["config"]["model"]:
+        print("warning: the runs used different arrival models", file=sys.stderr)
+    # under the open model throughput is the arrival rate, not something the app achieved
+    closed = before["config"]["model"] == after["config"]["model"] == "closed"
+
+    def change(old, new):
+        return (new - old) / old * 100 if old else 0.0
+
+    regressions = []
+    print(f"{'route':<16}{'req/s':>16}{'p50 ms':>22}{'p95 ms':>22}{'p99 ms':>22}")
+    names = sorted(set(before["routes"]) | set(after["routes"]))
+    for name in names + ["all"]:
+        old = before["overall"] if name == "all" else before["routes"].get(name)
+        new = after["overall"] if name == "all" else after["routes"].get(name)
+        if old is None or new is None:
+            print(f"{name:<16} only in {'after' if old is None else 'before'}")
+            continue
+        line = f"{name:<16}"
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            delta = change(old[key], new[key])
+            line += f"{old[key]:>8.1f} >{new[key]:>7.1f} {delta:+5.0f}%"
+            # fewer requests per second is worse, more milliseconds is worse
+            worse = -delta if key == "throughput_rps" else delta
+            if worse > args.threshold and (closed or key != "throughput_rps"):
+                regressions.append(f"{name} {key} {delta:+.1f}%")
+        if new["errors"] > old["errors"]:
+            regressions.append(f"{name} errors {old['errors']} -> {new['errors']}")
+        print(line)
+    for regression in regressions:
+        print(f"regression: {regression}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="put load on a running instance")
+    run_parser.add_argument("--url", default="http://127.0.0.1:5000")
+    run_parser.add_argument("--model", choices=["closed", "open"], default="closed")
+    run_parser.add_argument("--clients", type=int, default=16, help="concurrent clients, or most in flight when open")
+    run_parser.add_argument("--rate", type=float, default=50, help="open model arrivals per second")
+    run_parser.add_argument("--think", type=float, default=0, help="closed model mean seconds between a client's requests")
+    run_parser.add_argument("--duration", type=float, default=30, help="seconds")
+    run_parser.add_argument("--mix", help="name=weight,... over the default mix, or a json file")
+    run_parser.add_argument("--timeout", type=float, default=30)
+    run_parser.add_argument("--out", help="write the results to this json file")
+    run_parser.set_defaults(handler=run)
+
+    diff_parser = commands.add_parser("diff", help="compare two result files")
+    diff_parser.add_argument("before")
+    diff_parser.add_argument("after")
+    diff_parser.add_argument("--threshold", type=float, default=10, help="percent change that counts as a regression")
+    diff_parser.set_defaults(handler=diff)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
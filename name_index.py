@@ -0,0 +1,88 @@
+import bisect
+import threading
+import unicodedata
+
+
+def normalize(name):
+    # lower case, no accents and single spaces so "Café  Hop" and "cafe hop" meet
+    name = unicodedata.normalize("NFKD", name or "")
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(name.lower().split())
+
+
+class PrefixIndex:
+    """Sorted array of normalized names answering prefix lookups with bisect.
+
+    Every word start of a name gets its own key, so "hop" finds
+    "The Musical Hop" the same way "the mu" does.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._ids = []
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def _entry_keys(self, name):
+        words = normalize(name).split(" ")
+        return {" ".join(words[i:]) for i in range(len(words)) if words[i]}
+
+    def build(self, rows):
+        # rows is an iterable of (id, name), sorting once beats inserting one by one
+        entries = []
+        names = {}
+        for id, name in rows:
+            names[id] = name
+            entries.extend((key, id) for key in self._entry_keys(name))
+        entries.sort()
+        with self._lock:
+            self._keys = [key for key, _ in entries]
+            self._ids = [id for _, id in entries]
+            self._names = names
+
+    def add(self, id, name):
+        with self._lock:
+            self._remove(id)
+            self._names[id] = name
+            for key in self._entry_keys(name):
+                i = bisect.bisect_left(self._keys, key)
+                self._keys.insert(i, key)
+                self._ids.insert(i, id)
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def _remove(self, id):
+        name = self._names.pop(id, None)
+        if name is None:
+            return
+        for key in self._entry_keys(name):
+            i = bisect.bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i] == key:
+                if self._ids[i] == id:
+                    del self._keys[i]
+                    del self._ids[i]
+                    break
+                i += 1
+
+    def complete(self, prefix, k=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect.bisect_left(self._keys, prefix)
+            while i < len(self._keys) and len(results) < k:
+                if not self._keys[i].startswith(prefix):
+                    break
+                id = self._ids[i]
+                if id not in seen:
+                    seen.add(id)
+                    results.append({"id": id, "name": self._names[id]})
+                i += 1
+        return results
@@ -0,0 +1,293 @@
+import datetime
+import json
+import time
+
+from sqlalchemy import event, func, inspect, text
+from sqlalchemy.orm import attributes
+
+
+def _value(value):
+    # what the changes column stores for a column value
+    return value if value is None or isinstance(value, (bool, int, float, str)) else str(value)
+
+
+class Outbox:
+    """Records every change to the tracked models in the transaction that makes it.
+
+    Inserts, updates and deletes flushed through the session become outbox
+    rows in after_flush, so they commit or roll back with the change itself.
+    Changes to a genre association, made from either side of it, are recorded
+    as one event per venue or artist with the genre ids added and removed. A
+    deleted venue or artist takes its genre links along without an event of
+    their own, its delete event stands for them.
+    Query.update() and Query.delete() on a tracked model record the affected
+    ids when the session synchronised them, and an event without an id, which
+    asks consumers to rescan that entity, when it didn't. Statements executed
+    on the tables directly have to call record() themselves.
+
+    consume() hands the events after a consumer's checkpoint to a handler in
+    batches and moves the checkpoint once the handler returned, so every
+    event is delivered at least once and a handler can see one again after a
+    crash.
+    """
+
+    def __init__(self, db, event_model, checkpoint_model, settle=300):
+        self.db = db
+        self.event_model = event_model
+        self.checkpoint_model = checkpoint_model
+        # seconds an id gap may stay open before it's taken for a rolled back transaction, on
+        # databases where open writers can't be seen. sqlite and postgres never wait this out
+        self.settle = settle
+        # first id of a gap -> the postgres transactions that had written events when it was seen
+        self.gaps = {}
+        self.entities = {}
+        self.links = []
+        event.listen(db.session, "after_flush", self._after_flush)
+        event.listen(db.session, "after_bulk_update", self._after_bulk_update)
+        event.listen(db.session, "after_bulk_delete", self._after_bulk_delete)
+
+    def track(self, model, entity):
+        self.entities[model] = entity
+
+    def track_link(self, entity, model, attribute, genre_model, genre_attribute):
+        # a many to many like Venue.genres / Genre.venues, recorded under entity with model's id
+        self.links.append((entity, model, attribute, genre_model, genre_attribute))
+
+    # recording
+
+    def record(self, entity, op, entity_id=None, changes=None, session=None):
+        """Adds an event for a change the session events can't see, in the current transaction."""
+        self._write(session or self.db.session(), [(entity, op, entity_id, changes)])
+
+    def _write(self, session, events):
+        if not events:
+            return
+        now = datetime.datetime.now()
+        session.execute(
+            self.event_model.__table__.insert(),
+            [
+                {
+                    "entity": entity,
+                    "entity_id": entity_id,
+                    "op": op,
+                    "changes": json.dumps(changes or {}, default=str, sort_keys=True),
+                    "created_at": now,
+                }
+                for entity, op, entity_id, changes in events
+            ],
+        )
+
+    def _after_flush(self, session, flush_context):
+        events = []
+        for instance in session.new:
+            entity = self.entities.get(type(instance))
+            if entity:
+                state = inspect(instance)
+                columns = {
+                    c.key: _value(state.dict[c.key]) for c in state.mapper.column_attrs if c.key in state.dict
+                }
+                events.append((entity, "insert", instance.id, columns))
+        for instance in session.dirty:
+            entity = self.entities.get(type(instance))
+            if entity:
+                state = inspect(instance)
+                changes = {}
+                for column in state.mapper.column_attrs:
+                    history = state.attrs[column.key].history
+                    if history.has_changes():
+                        changes[column.key] = _value(history.added[0] if history.added else None)
+                if changes:
+                    events.append((entity, "update", instance.id, changes))
+        for instance in session.deleted:
+            entity = self.entities.get(type(instance))
+            if entity:
+                state = inspect(instance)
+                columns = {
+                    c.key: _value(state.dict[c.key]) for c in state.mapper.column_attrs if c.key in state.dict
+                }
+                events.append((entity, "delete", instance.id, columns))
+        events.extend(self._link_events(session))
+        self._write(session, events)
+
+    def _link_events(self, session):
+        changed = {}
+        passive = attributes.PASSIVE_NO_INITIALIZE
+        deleted = set(session.deleted)
+        for instance in list(session.new) + list(session.dirty):
+            for entity, model, attribute, genre_model, genre_attribute in self.links:
+                if isinstance(instance, model):
+                    history = attributes.get_history(instance, attribute, passive=passive)
+                    pairs = (
+                        [(instance, genre) for genre in history.added or ()],
+                        [(instance, genre) for genre in history.deleted or ()],
+                    )
+                elif isinstance(instance, genre_model):
+                    history = attributes.get_history(instance, genre_attribute, passive=passive)
+                    pairs = (
+                        [(owner, instance) for owner in history.added or ()],
+                        [(owner, instance) for owner in history.deleted or ()],
+                    )
+                else:
+                    continue
+                for key, found in zip(("added", "removed"), pairs):
+                    for owner, genre in found:
+                        if owner in deleted:
+                            continue
+                        changes = changed.setdefault((entity, owner.id), {"added": set(), "removed": set()})
+                        changes[key].add(genre.id)
+        return [
+            (entity, "update", owner_id, {key: sorted(ids) for key, ids in changes.items()})
+            for (entity, owner_id), changes in sorted(changed.items())
+        ]
+
+    def _bulk(self, context, op):
+        entity = self.entities.get(context.mapper.class_)
+        if not entity:
+            return
+        if getattr(context, "matched_objects", None) is not None:
+            ids = [instance.id for instance in context.matched_objects]
+        elif getattr(context, "matched_rows", None) is not None:
+            ids = [row[0] for row in context.matched_rows]
+        else:
+            ids = None
+        values = {}
+        if op == "update":
+            values = {getattr(k, "key", str(k)): _value(v) for k, v in context.values.items()}
+        if ids is None:
+            self._write(context.session, [(entity, f"bulk_{op}", None, values)])
+        else:
+            self._write(context.session, [(entity, op, id, values) for id in ids])
+
+    def _after_bulk_update(self, update_context):
+        self._bulk(update_context, "update")
+
+    def _after_bulk_delete(self, delete_context):
+        self._bulk(delete_context, "delete")
+
+    # consuming
+
+    def position(self, consumer):
+        checkpoint = self.db.session.query(self.checkpoint_model).get(consumer)
+        return checkpoint.position if checkpoint else 0
+
+    def _writers(self):
+        # virtual transaction ids of the other postgres sessions holding uncommitted event rows.
+        # an insert keeps its ROW EXCLUSIVE lock on the table until the transaction ends
+        rows = self.db.session.execute(
+            text(
+                "SELECT virtualtransaction FROM pg_locks WHERE locktype = 'relation'"
+                " AND relation = CAST(:table AS regclass) AND mode = 'RowExclusiveLock'"
+                " AND granted AND pid <> pg_backend_pid()"
+            ),
+            {"table": self.event_model.__table__.name},
+        )
+        return {row[0] for row in rows}
+
+    def _gap_settled(self, first, row):
+        """Whether the ids from first up to row's can't commit any more.
+
+        sqlite has one writer at a time and commits ids in order, a gap behind
+        a committed row is a rollback or a prune. On postgres the events of the
+        gap belong to transactions that had inserted them before row's did, so
+        they are among the writers open when the gap is first seen. Once those
+        have all ended the gap stays. Elsewhere it's given settle seconds.
+        """
+        dialect = self.db.session.get_bind().dialect.name
+        if dialect == "sqlite":
+            return True
+        if dialect == "postgresql":
+            writers = self._writers()
+            return not self.gaps.setdefault(first, writers) & writers
+        return row.created_at <= datetime.datetime.now() - datetime.timedelta(seconds=self.settle)
+
+    def pending(self, consumer, limit=100):
+        """The next events after consumer's checkpoint, as dicts, stopping at an id gap that can still fill.
+
+        Ids are handed out when a transaction inserts its event, not when it
+        commits, so a gap can be a transaction still in flight. Reading past
+        it would move the checkpoint beyond events that haven't committed yet.
+        """
+        model = self.event_model
+        position = self.position(consumer)
+        rows = (
+            self.db.session.query(model)
+            .filter(model.id > position)
+            .order_by(model.id)
+            .limit(limit)
+            .all()
+        )
+        events = []
+        # a new consumer starts at the oldest event kept, whatever was pruned before it
+        expected = position + 1 if position else None
+        for row in rows:
+            if expected is not None and row.id != expected and not self._gap_settled(expected, row):
+                break
+            # the gap, if there was one, is behind us whether it filled or was given up on
+            self.gaps.pop(expected, None)
+            events.append(
+                {
+                    "id": row.id,
+                    "entity": row.entity,
+                    "entity_id": row.entity_id,
+                    "op": row.op,
+                    "changes": json.loads(row.changes),
+                    "created_at": row.created_at,
+                }
+            )
+            expected = row.id + 1
+        # the snapshot isn't held while the handler runs
+        self.db.session.rollback()
+        return events
+
+    def checkpoint(self, consumer, position):
+        checkpoint = self.db.session.query(self.checkpoint_model).get(consumer)
+        if checkpoint is None:
+            checkpoint = self.checkpoint_model(consumer=consumer, position=0)
+            self.db.session.add(checkpoint)
+        checkpoint.position = max(checkpoint.position, position)
+        checkpoint.updated_at = datetime.datetime.now()
+        self.db.session.commit()
+
+    def consume(self, consumer, handler, batch_size=100):
+        """Calls handler(events) with the next batch for consumer, then checkpoints past it.
+
+        Returns how many events were handled. If the handler raises, the
+        checkpoint stays and the same batch comes back next time.
+        """
+        events = self.pending(consumer, batch_size)
+        if not events:
+            return 0
+        handler(events)
+        self.checkpoint(consumer, events[-1]["id"])
+        return len(events)
+
+    def run(self, consumer, handler, batch_size=100, poll=1.0, stop=None):
+        # consumes until stop() is true, sleeping poll seconds whenever there's nothing new
+        while not (stop and stop()):
+            if not self.consume(consumer, handler, batch_size):
+                time.sleep(poll)
+
+    def prune(self):
+        # drops the events every consumer is past, returns how many. the newest event is kept, so
+        # a database whose ids come from max(id) + 1 can't hand out ids a checkpoint already passed
+        model = self.event_model
+        positions = [row[0] for row in self.db.session.query(self.checkpoint_model.position)]
+        newest = self.db.session.query(func.max(model.id)).scalar()
+        if not positions or newest is None:
+            return 0
+        deleted = (
+            self.db.session.query(model)
+            .filter(model.id <= min(positions), model.id < newest)
+            .delete(synchronize_session=False)
+        )
+        self.db.session.commit()
+        return deleted
+
+    def status(self):
+        # consumer -> (position, events behind)
+        model = self.event_model
+        result = {}
+        for checkpoint in self.db.session.query(self.checkpoint_model).order_by(self.checkpoint_model.consumer):
+            behind = self.db.session.query(model).filter(model.id > checkpoint.position).count()
+            result[checkpoint.consumer] = (checkpoint.position, behind)
+        return result
@@ -0,0 +1,201 @@
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# per thread state, so the sql listeners cost one attribute read when nobody is profiling
+_local = threading.local()
+
+
+def _signature(secret, path, expires):
+    return hmac.new(secret.encode(), f"{path}\n{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def profile_token(secret, path, ttl=300):
+    # value of the X-Profile header that turns profiling on for requests to path for the next ttl seconds
+    expires = int(time.time()) + ttl
+    return f"{expires}.{_signature(secret, path, expires)}"
+
+
+def check_token(secret, path, token, max_ttl):
+    # a token for path, signed with secret, that hasn't expired and doesn't reach further than max_ttl ahead
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit():
+        return False
+    remaining = int(expires) - time.time()
+    if not 0 < remaining <= max_ttl:
+        return False
+    return hmac.compare_digest(signature, _signature(secret, path, int(expires)))
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    state = getattr(_local, "state", None)
+    if state is not None:
+        state.sql_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    state = getattr(_local, "state", None)
+    if state is not None:
+        state.sql_time += time.perf_counter() - state.sql_started
+        state.sql_count += 1
+
+
+def _module(frame):
+    return frame.f_globals.get("__name__") or ""
+
+
+def _in_template(frame):
+    # compiled templates have the .html file as their code's file name, the rest runs in jinja2
+    return frame.f_code.co_filename.endswith(".html") or _module(frame).split(".")[0] == "jinja2"
+
+
+def _in_sql(frame):
+    return _module(frame).split(".")[0] == "sqlalchemy"
+
+
+class _Sampler(threading.Thread):
+    """Walks the profiled thread's stack at a fixed interval for the flame graph.
+
+    Also counts the samples taken inside a template, leaving out the ones
+    where the template was waiting on a query: the sql listeners time those.
+    """
+
+    def __init__(self, ident, interval):
+        super().__init__(daemon=True)
+        self.target_ident = ident
+        self.interval = interval
+        self.stacks = Counter()
+        self.template_samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target_ident)
+            stack = []
+            template = sql = False
+            while frame is not None:
+                code = frame.f_code
+                name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                stack.append(name.replace(";", ":"))
+                template = template or _in_template(frame)
+                sql = sql or _in_sql(frame)
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+                self.template_samples += template and not sql
+
+
+class _ProfileState:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.sql_time = 0.0
+        self.sql_count = 0
+        self.sql_started = 0.0
+        self.started = time.perf_counter()
+        self.profile = cProfile.Profile()
+        self.sampler = _Sampler(threading.get_ident(), 0.001)
+
+
+class RequestProfiler:
+    """Opt-in per request profiling.
+
+    A request is profiled when PROFILE_ENABLED is set, when it wins the
+    PROFILE_SAMPLE_RATE draw, or when it carries an unexpired X-Profile
+    header signed with PROFILE_SECRET (see profile_token). Each profiled
+    request leaves a .pstats file, a .collapsed file for flamegraph.pl /
+    speedscope, and a .json summary splitting the time between sql,
+    templates and python. Queries a template runs count as sql, not as
+    template time.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self._start)
+        app.after_request(self._tag)
+        app.teardown_request(self._finish)
+
+    def _wanted(self):
+        config = self.app.config
+        if config.get("PROFILE_ENABLED"):
+            return True
+        rate = config.get("PROFILE_SAMPLE_RATE", 0)
+        if rate and random.random() < rate:
+            return True
+        secret = config.get("PROFILE_SECRET")
+        token = request.headers.get("X-Profile")
+        return bool(secret and token) and check_token(
+            secret, request.path, token, config.get("PROFILE_TOKEN_TTL", 300)
+        )
+
+    def _start(self):
+        if not self._wanted():
+            return
+        state = _ProfileState()
+        _local.state = state
+        g.profile_state = state
+        state.sampler.start()
+        state.profile.enable()
+
+    def _tag(self, response):
+        state = g.get("profile_state")
+        if state is not None:
+            response.headers["X-Profile-Id"] = state.id
+        return response
+
+    def _finish(self, exc=None):
+        state = g.pop("profile_state", None)
+        if state is None:
+            return
+        state.profile.disable()
+        state.sampler.stopped.set()
+        state.sampler.join()
+        _local.state = None
+        self._write(state)
+
+    def _write(self, state):
+        directory = self.app.config.get("PROFILE_DIR", "profiles")
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint}-{state.id}"
+        base = os.path.join(directory, name)
+
+        state.profile.dump_stats(base + ".pstats")
+
+        samples = state.sampler.stacks
+        with open(base + ".collapsed", "w") as f:
+            for stack, count in samples.items():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+        total = time.perf_counter() - state.started
+        # sampled share of template frames outside sql, the sql share is measured exactly by the listeners
+        sampled = sum(samples.values())
+        template_time = total * state.sampler.template_samples / sampled if sampled else 0.0
+        summary = {
+            "path": request.full_path,
+            "endpoint": request.endpoint,
+            "total_ms": round(total * 1000, 3),
+            "sql_ms": round(state.sql_time * 1000, 3),
+            "sql_queries": state.sql_count,
+            "template_ms": round(template_time * 1000, 3),
+            "python_ms": round(max(total - state.sql_time - template_time, 0) * 1000, 3),
+            "samples": sampled,
+        }
+        with open(base + ".json", "w") as f:
+            json.dump(summary, f, indent=2)
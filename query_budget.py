@@ -0,0 +1,219 @@
+"""Per route SQL statement budgets.
+
+Views declare the most statements one request may run with @query_budget(n).
+Running this module seeds a scratch database, requests every route against it
+and fails, listing the statements, when a route goes over its budget or has
+none. The seed has many shows per venue and artist, so a lazy load per row
+can't hide under a constant budget.
+
+    python query_budget.py [--database URL] [--verbose]
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def query_budget(limit):
+    # goes under @app.route, the harness reads it back from app.view_functions
+    def decorate(view):
+        view.query_budget = limit
+        return view
+
+    return decorate
+
+
+class QueryCounter:
+    """Records every statement any engine runs while the block is active."""
+
+    def __init__(self):
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(" ".join(statement.split()))
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, "before_cursor_execute", self._record)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+# extra request data for routes that need more than their url arguments. search terms
+# have to match seeded names, a search that finds nothing skips its follow up queries
+FORMS = {
+    "search_venues": {"search_term": "venue"},
+    "search_artists": {"search_term": "artist"},
+}
+QUERY_STRINGS = {
+    "search": {"search_term": "the"},
+    "autocomplete": {"q": "the"},
+    "shows": {"state": "CA", "genre": "Jazz"},
+    "nearby_venues": {"lat": "37.77", "lng": "-122.42", "k": "5"},
+    "nearby_shows": {"lat": "37.77", "lng": "-122.42", "radius": "10"},
+}
+# the harness only reads: routes that write are left out, and so are the ones that
+# never touch the database (thumbnails would go to the network, streams never end)
+SKIP = {
+    "static",
+    "thumbnail",
+    "show_stream",
+    "create_venue_submission",
+    "create_artist_submission",
+    "create_show_submission",
+    "edit_venue_submission",
+    "edit_artist_submission",
+    "delete_venue",
+}
+
+
+def seed(fyyur, venues=12, artists=12, shows_each=8):
+    db = fyyur.db
+    genres = [fyyur.Genre(name=n) for n in ("Jazz", "Folk", "Blues", "Rock n Roll", "Classical")]
+    db.session.add_all(genres)
+    places = [
+        ("San Francisco", "CA", 37.77, -122.42),
+        ("New York", "NY", 40.71, -74.01),
+        ("Austin", "TX", 30.27, -97.74),
+    ]
+    venue_rows, artist_rows = [], []
+    for i in range(venues):
+        city, state, lat, lng = places[i % len(places)]
+        venue_rows.append(
+            fyyur.Venue(
+                name=f"The Venue {i}",
+                city=city,
+                state=state,
+                address=f"{i} Main St",
+                phone="555",
+                genres=genres[i % 5 : i % 5 + 2],
+                seeking_talent=i % 2 == 0,
+                latitude=lat + i * 0.01,
+                longitude=lng - i * 0.01,
+            )
+        )
+    for i in range(artists):
+        city, state, _, _ = places[i % len(places)]
+        artist_rows.append(
+            fyyur.Artist(
+                name=f"The Artist {i}",
+                city=city,
+                state=state,
+                phone="555",
+                genres=genres[i % 5 : i % 5 + 2],
+                seeking_venue=i % 2 == 1,
+            )
+        )
+    db.session.add_all(venue_rows + artist_rows)
+    db.session.flush()
+    now = datetime.datetime.now()
+    for i, venue in enumerate(venue_rows):
+        for j in range(shows_each):
+            artist = artist_rows[(i + j) % artists]
+            start = now + datetime.timedelta(days=(j - shows_each // 2) * 20 + 1)
+            db.session.add(fyyur.Show(venue_id=venue.id, artist_id=artist.id, start_time=start))
+    db.session.flush()
+    fyyur.refresh_documents(
+        venue_ids=[v.id for v in venue_rows], artist_ids=[a.id for a in artist_rows]
+    )
+    fyyur.apply_rollup({}, fyyur.show_facts())
+    db.session.commit()
+    fyyur.refresh_recommendations()
+
+
+def sample_arguments(fyyur):
+    venue = fyyur.Venue.query.order_by(fyyur.Venue.id).first()
+    return {
+        "venue_id": venue.id,
+        "artist_id": fyyur.Artist.query.order_by(fyyur.Artist.id).first().id,
+        "genre_id": fyyur.Genre.query.order_by(fyyur.Genre.id).first().id,
+        "state": venue.state,
+        "city": venue.city,
+        "fmt": "ics",
+    }
+
+
+def read_requests(fyyur):
+    """Yields (endpoint, url, request options) for every route the harness reads."""
+    app = fyyur.app
+    with app.app_context():
+        values = sample_arguments(fyyur)
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if rule.endpoint in SKIP:
+            continue
+        method = "POST" if rule.endpoint in FORMS else "GET"
+        if method not in rule.methods:
+            continue
+        url = rule.build({k: values[k] for k in rule.arguments}, append_unknown=False)[1]
+        options = {
+            "method": method,
+            "data": FORMS.get(rule.endpoint),
+            "query_string": QUERY_STRINGS.get(rule.endpoint),
+        }
+        yield rule.endpoint, url, options
+
+
+def measure(fyyur):
+    """Yields (endpoint, url, statements, budget) for every route."""
+    client = fyyur.app.test_client()
+    client.get("/")  # before_first_request work isn't any route's
+    for endpoint, url, options in read_requests(fyyur):
+        fyyur.detail_cache.clear()
+        with QueryCounter() as counter:
+            # streamed bodies run their queries while being read
+            client.open(url, **options).get_data()
+        view = fyyur.app.view_functions[endpoint]
+        yield endpoint, url, counter.statements, getattr(view, "query_budget", None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--database", help="run against this (already seeded) database instead of a scratch one"
+    )
+    parser.add_argument("--verbose", action="store_true", help="list the statements of every route")
+    args = parser.parse_args(argv)
+
+    import app as fyyur
+
+    scratch = None
+    if args.database:
+        fyyur.app.config["SQLALCHEMY_DATABASE_URI"] = args.database
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        scratch.close()
+        fyyur.app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{scratch.name}"
+    fyyur.app.config["TESTING"] = True
+    fyyur.admission.enabled = False
+    try:
+        if scratch:
+            with fyyur.app.app_context():
+                fyyur.db.create_all()
+                seed(fyyur)
+        failures = 0
+        for endpoint, url, statements, budget in measure(fyyur):
+            over = budget is None or len(statements) > budget
+            failures += over
+            status = "no budget" if budget is None else ("OVER" if over else "ok")
+            limit = "-" if budget is None else budget
+            print(f"{status:>9}  {len(statements):>3} / {limit:<3} {endpoint} {url}")
+            if over or args.verbose:
+                for statement in statements:
+                    print(f"{'':15}{statement[:200]}")
+        print(f"{failures} route(s) over budget" if failures else "every route within budget")
+        return 1 if failures else 0
+    finally:
+        if scratch:
+            os.unlink(scratch.name)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import numpy as np
+from scipy import sparse
+
+
+class FeatureSpace:
+    """Maps (block, key) features such as ("genre", 3) or ("city", "NY") to matrix columns.
+
+    Matrices built from the same space share their columns, so venues and
+    artists can be compared with each other as well as among themselves.
+    """
+
+    def __init__(self):
+        self.columns = {}
+
+    def matrix(self, ids, blocks):
+        # blocks is a list of (name, weight, pairs) where pairs yields (entity_id, key)
+        index = {id: i for i, id in enumerate(ids)}
+        rows, cols, values = [], [], []
+        for name, weight, pairs in blocks:
+            for entity_id, key in pairs:
+                row = index.get(entity_id)
+                if row is None or key is None:
+                    continue
+                rows.append(row)
+                cols.append(self.columns.setdefault((name, key), len(self.columns)))
+                values.append(weight)
+        # repeated pairs add up, which is what we want for "played there three times"
+        return sparse.csr_matrix(
+            (values, (rows, cols)), shape=(len(ids), len(self.columns)), dtype=np.float64
+        )
+
+    def align(self, matrix):
+        # widen a matrix built before later matrices added columns to the space
+        matrix = matrix.tocsr(copy=True)
+        matrix.resize((matrix.shape[0], len(self.columns)))
+        return matrix
+
+
+def normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ matrix
+
+
+def top_k_cosine(matrix, k, rows=None, batch_size=512):
+    """Top k most similar rows (by cosine) for each of rows, excluding the row itself.
+
+    Similarities are computed a batch of rows at a time as one sparse product,
+    so memory stays at batch_size x n no matter how many rows there are.
+    Returns {row: [(other_row, score), ...]} best first, zero scores dropped.
+    """
+    normalized = normalize_rows(matrix.tocsr())
+    n = normalized.shape[0]
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+    result = {}
+    k = min(k, n - 1)
+    if k <= 0:
+        return {int(row): [] for row in rows}
+    transposed = normalized.T.tocsc()
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start : start + batch_size]
+        scores = (normalized[batch] @ transposed).toarray()
+        scores[np.arange(len(batch)), batch] = 0.0
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for i, row in enumerate(batch):
+            best = top[i][np.argsort(-scores[i, top[i]], kind="stable")]
+            result[int(row)] = [
+                (int(col), float(scores[i, col])) for col in best if scores[i, col] > 0
+            ]
+    return result
+
+
+def pair_scores(components, rows=None, min_score=0.0, batch_size=512):
+    """Weighted sum of left x right products for every (row, col) pair, batch by batch.
+
+    components is a list of (weight, left, right) with left n x f and right
+    m x f sharing their columns. A precomputed n x m pair matrix fits as
+    (weight, pairs, identity(m)). Yields (row, col, score) for each pair
+    scoring at least min_score (and above zero).
+    """
+    components = [
+        (weight, left.tocsr(), right.T.tocsc()) for weight, left, right in components
+    ]
+    n = components[0][1].shape[0]
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start : start + batch_size]
+        scores = sum(weight * (left[batch] @ right).toarray() for weight, left, right in components)
+        hits = np.argwhere((scores >= min_score) & (scores > 0))
+        for i, col in hits:
+            yield int(batch[i]), int(col), float(scores[i, col])
+
+
+def history_matrix(left_ids, right_ids, pairs):
+    # (left_id, right_id, count) rows as an n x m matrix scaled to 0..1 on a log scale
+    left = {id: i for i, id in enumerate(left_ids)}
+    right = {id: i for i, id in enumerate(right_ids)}
+    rows, cols, values = [], [], []
+    for left_id, right_id, count in pairs:
+        if left_id in left and right_id in right:
+            rows.append(left[left_id])
+            cols.append(right[right_id])
+            values.append(np.log1p(count))
+    matrix = sparse.csr_matrix(
+        (values, (rows, cols)), shape=(len(left_ids), len(right_ids)), dtype=np.float64
+    )
+    if matrix.nnz:
+        matrix = matrix / matrix.max()
+    return matrix
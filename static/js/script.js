@@ -2,3 +2,81 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// fills the search box datalist from /autocomplete as the user types
+document.addEventListener('input', function (event) {
+  var input = event.target;
+  var kind = input.getAttribute && input.getAttribute('data-autocomplete');
+  if (!kind) return;
+  var list = document.getElementById(input.getAttribute('list'));
+  fetch('/autocomplete?type=' + kind + '&q=' + encodeURIComponent(input.value))
+    .then(function (response) { return response.json(); })
+    .then(function (data) {
+      list.innerHTML = '';
+      (data[kind] || []).forEach(function (item) {
+        var option = document.createElement('option');
+        option.value = item.name;
+        list.appendChild(option);
+      });
+    });
+});
+
+// keeps the /shows tiles current from /shows/stream instead of reloading the page
+(function () {
+  var container = document.querySelector('[data-show-stream]');
+  if (!container || !window.EventSource) return;
+
+  function escape(text) {
+    var div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+  }
+
+  function tile(show) {
+    var column = document.createElement('div');
+    column.className = 'col-sm-4';
+    column.setAttribute('data-show-id', show.id);
+    column.setAttribute('data-start', show.start_time.replace('T', ' '));
+    column.innerHTML =
+      '<div class="tile tile-show">' +
+      '<img src="' + escape(show.artist_image_link || '') + '" alt="Artist Image" />' +
+      '<h4>' + escape(show.start_time_label) + '</h4>' +
+      '<h5><a href="/artists/' + show.artist_id + '">' + escape(show.artist_name) + '</a></h5>' +
+      '<p>playing at</p>' +
+      '<h5><a href="/venues/' + show.venue_id + '">' + escape(show.venue_name) + '</a></h5>' +
+      '</div>';
+    return column;
+  }
+
+  function find(id) {
+    return container.querySelector('[data-show-id="' + id + '"]');
+  }
+
+  function place(column) {
+    // tiles are in start time order
+    var start = column.getAttribute('data-start');
+    var next = Array.prototype.find.call(container.children, function (other) {
+      return other.getAttribute('data-start') > start;
+    });
+    container.insertBefore(column, next || null);
+  }
+
+  var source = new EventSource(container.getAttribute('data-show-stream'));
+  source.addEventListener('created', function (event) {
+    var show = JSON.parse(event.data).show;
+    if (!find(show.id)) place(tile(show));
+  });
+  source.addEventListener('updated', function (event) {
+    var show = JSON.parse(event.data).show;
+    var old = find(show.id);
+    if (old) container.removeChild(old);
+    place(tile(show));
+  });
+  source.addEventListener('cancelled', function (event) {
+    var old = find(JSON.parse(event.data).show.id);
+    if (old) container.removeChild(old);
+  });
+  source.addEventListener('reload', function () {
+    window.location.reload();
+  });
+})();
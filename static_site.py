@@ -0,0 +1,107 @@
+import concurrent.futures
+import json
+import os
+import shutil
+
+MANIFEST = "build-manifest.json"
+
+
+def page_path(out, url):
+    # /venues/3 -> out/venues/3/index.html, what a file server looks for at /venues/3/
+    return os.path.join(out, url.strip("/"), "index.html")
+
+
+def _init_worker():
+    # connections opened by the parent before the fork can't be shared, start with fresh ones
+    import app as fyyur
+
+    fyyur.db.get_engine(fyyur.app).dispose()
+
+
+def render(urls, out):
+    """Renders urls through the app into out. Runs in a pool worker, returns the failed urls."""
+    import app as fyyur
+
+    fyyur.app.config["TESTING"] = True
+    fyyur.admission.enabled = False
+    client = fyyur.app.test_client()
+    failed = []
+    for url in urls:
+        response = client.get(url)
+        if response.status_code != 200:
+            failed.append((url, response.status_code))
+            continue
+        path = page_path(out, url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.tmp"
+        with open(temp, "wb") as f:
+            f.write(response.get_data())
+        os.replace(temp, path)
+    return failed
+
+
+def copy_assets(source, out):
+    # the static folder, skipping files that are already there unchanged
+    copied = 0
+    for root, _, files in os.walk(source):
+        target_dir = os.path.join(out, "static", os.path.relpath(root, source))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in files:
+            src, dst = os.path.join(root, name), os.path.join(target_dir, name)
+            stat = os.stat(src)
+            if os.path.exists(dst):
+                existing = os.stat(dst)
+                if existing.st_size == stat.st_size and existing.st_mtime >= stat.st_mtime:
+                    continue
+            shutil.copy2(src, dst)
+            copied += 1
+    return copied
+
+
+def build(stamps, out, static_folder, jobs=None, full=False, chunk_size=50, log=print):
+    """Renders the pages whose stamp changed since the last build into out.
+
+    stamps maps each page url to a fingerprint of the rows it shows. The
+    previous build's stamps are kept in out/build-manifest.json, so a page is
+    only rendered again when its fingerprint differs (or full is set), and the
+    pages of deleted rows are removed. Rendering is spread over a process pool
+    in chunks of chunk_size urls.
+    """
+    os.makedirs(out, exist_ok=True)
+    manifest_path = os.path.join(out, MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_path) and not full:
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    changed = sorted(
+        url
+        for url, stamp in stamps.items()
+        if previous.get(url) != stamp or not os.path.exists(page_path(out, url))
+    )
+    removed = [url for url in previous if url not in stamps]
+
+    failed = []
+    if changed:
+        chunks = [changed[i : i + chunk_size] for i in range(0, len(changed), chunk_size)]
+        with concurrent.futures.ProcessPoolExecutor(jobs, initializer=_init_worker) as pool:
+            for result in pool.map(render, chunks, [out] * len(chunks)):
+                failed.extend(result)
+    for url in removed:
+        path = page_path(out, url)
+        if os.path.exists(path):
+            os.remove(path)
+    assets = copy_assets(static_folder, out)
+
+    # a failed page keeps its old stamp, so the next build tries it again
+    failed_urls = {url for url, _ in failed}
+    manifest = {url: stamp for url, stamp in stamps.items() if url not in failed_urls}
+    manifest.update({url: previous[url] for url in failed_urls if url in previous})
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    for url, status in failed:
+        log(f"{url}: {status}")
+    log(
+        f"{len(changed) - len(failed)} pages rendered, {len(stamps) - len(changed)} unchanged, "
+        f"{len(removed)} removed, {assets} static files copied"
+    )
+    return not failed
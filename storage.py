@@ -0,0 +1,108 @@
+import threading
+
+import sqlalchemy as sa
+from flask import has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.pool import QueuePool
+
+# requests with these methods only read, so their queries may go to a reader connection
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def is_sqlite_file(sa_url):
+    return sa_url.drivername.startswith("sqlite") and sa_url.database not in (None, "", ":memory:")
+
+
+def _pragmas(config, readonly):
+    def on_connect(dbapi_connection, record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # with WAL a crash can lose the last commits but never corrupts the file
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute(f"PRAGMA busy_timeout={int(config.get('SQLITE_BUSY_TIMEOUT', 5) * 1000)}")
+        cursor.execute(f"PRAGMA mmap_size={int(config.get('SQLITE_MMAP_SIZE', 256 << 20))}")
+        # negative is KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{int(config.get('SQLITE_CACHE_SIZE_KB', 64 << 10))}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if readonly:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    return on_connect
+
+
+class RoutingSession(SignallingSession):
+    """Sends the queries of read-only requests to the reader pool, everything else to the writer."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context() and request.method in READ_METHODS:
+            reader = self.db.reader_engine(self.app)
+            if reader is not None:
+                return reader
+        return super().get_bind(mapper, clause)
+
+
+class SQLAlchemyStorage(SQLAlchemy):
+    """flask_sqlalchemy with a SQLite mode alongside Postgres.
+
+    For a sqlite:/// file database the main engine becomes the single writer
+    connection and a separate pool of SQLITE_READERS query_only connections
+    serves GET requests. Every connection gets the WAL, mmap and cache size
+    pragmas. For any other database nothing changes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._readers = {}
+        self._readers_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        if is_sqlite_file(sa_url):
+            # one writer, sqlite takes a single write lock per database anyway
+            options["poolclass"] = QueuePool
+            options["pool_size"] = 1
+            options["max_overflow"] = 0
+            connect_args = options.setdefault("connect_args", {})
+            connect_args["check_same_thread"] = False
+            connect_args.setdefault("timeout", app.config.get("SQLITE_BUSY_TIMEOUT", 5))
+        return super().apply_driver_hacks(app, sa_url, options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        if is_sqlite_file(engine.url):
+            event.listen(engine, "connect", _pragmas(self.get_app().config, readonly=False))
+        return engine
+
+    def reader_engine(self, app=None):
+        # None when the database isn't a sqlite file or readers are turned off
+        app = self.get_app(app)
+        writer = self.get_engine(app)
+        size = app.config.get("SQLITE_READERS", 4)
+        if not size or not is_sqlite_file(writer.url):
+            return None
+        key = str(writer.url)
+        with self._readers_lock:
+            reader = self._readers.get(key)
+            if reader is None:
+                reader = sa.create_engine(
+                    writer.url,
+                    poolclass=QueuePool,
+                    pool_size=size,
+                    max_overflow=0,
+                    connect_args={
+                        "check_same_thread": False,
+                        "timeout": app.config.get("SQLITE_BUSY_TIMEOUT", 5),
+                    },
+                )
+                event.listen(reader, "connect", _pragmas(app.config, readonly=True))
+                self._readers[key] = reader
+            return reader
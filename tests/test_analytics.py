@@ -0,0 +1,87 @@
+import datetime
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as fyyur  # noqa: E402
+
+
+@pytest.fixture
+def client(tmp_path):
+    fyyur.app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'fyyur.db'}"
+    fyyur.app.config["TESTING"] = True
+    fyyur.admission.enabled = False
+    with fyyur.app.app_context():
+        fyyur.db.create_all()
+        jazz, folk = fyyur.Genre(name="Jazz"), fyyur.Genre(name="Folk")
+        venue = fyyur.Venue(name="The Musical Hop", city="San Francisco", state="CA", phone="1", facebook_link="f")
+        artist = fyyur.Artist(name="Guns N Petals", city="San Francisco", state="CA", phone="1", facebook_link="f")
+        artist.genres = [jazz]
+        fyyur.db.session.add_all([folk, venue, artist])
+        fyyur.db.session.flush()
+        start = datetime.datetime.combine(datetime.date.today().replace(day=1), datetime.time(20))
+        for days in (0, 1, 2):
+            fyyur.db.session.add(fyyur.Show(venue=venue, artist=artist, start_time=start + datetime.timedelta(days=days)))
+        fyyur.apply_rollup({}, fyyur.show_facts())
+        fyyur.db.session.commit()
+        yield fyyur.app.test_client()
+        fyyur.db.session.remove()
+        fyyur.db.drop_all()
+        fyyur.db.get_engine().dispose()
+
+
+def report():
+    with fyyur.app.app_context():
+        return fyyur.analytics_report(1)
+
+
+def edit(client, kind, **fields):
+    form = {"name": "", "city": "San Francisco", "state": "CA", "phone": "1", "facebook_link": "f"}
+    form.update(fields)
+    return client.post(f"/{kind}/1/edit", data=form)
+
+
+def test_since_counts_this_month_as_the_first():
+    today = datetime.date(2026, 10, 19)
+    assert fyyur.analytics_since(today, 1) == "2026-10"
+    assert fyyur.analytics_since(today, 2) == "2026-09"
+    assert fyyur.analytics_since(today, 12) == "2025-11"
+
+
+def test_since_crosses_year_boundaries():
+    assert fyyur.analytics_since(datetime.date(2026, 1, 1), 2) == "2025-12"
+    assert fyyur.analytics_since(datetime.date(2026, 3, 31), 3) == "2026-01"
+    assert fyyur.analytics_since(datetime.date(2026, 12, 31), 24) == "2025-01"
+    assert fyyur.analytics_since(datetime.date(2026, 10, 19), 120) == "2016-11"
+
+
+def test_moving_and_renaming_a_venue_shows_in_the_report(client):
+    edit(client, "venues", name="The Hop", city="Oakland", genres=[])
+    data = report()
+    assert [(r["label"], r["shows"]) for r in data["shows_per_city"]] == [("Oakland, CA", 3)]
+    assert [(r["label"], r["shows"]) for r in data["busiest_venues"]] == [("The Hop", 3)]
+
+
+def test_changing_an_artists_genres_moves_its_shows(client):
+    edit(client, "artists", name="Guns N Petals", genres=["Folk"])
+    assert [(r["label"], r["shows"]) for r in report()["genre_mix"]] == [("Folk", 3)]
+
+
+def test_unchanged_edit_reads_no_shows(client):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = fyyur.db.get_engine()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        edit(client, "artists", name="Guns N Petals", genres=["Jazz"])
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert statements
+    assert not [s for s in statements if "FROM show" in s or "analytics_rollup" in s]
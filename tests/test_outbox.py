@@ -0,0 +1,80 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as fyyur  # noqa: E402
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    fyyur.app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'fyyur.db'}"
+    fyyur.app.config["TESTING"] = True
+    with fyyur.app.app_context():
+        fyyur.db.create_all()
+        yield fyyur.change_outbox
+        fyyur.db.session.remove()
+        fyyur.db.drop_all()
+        fyyur.db.get_engine().dispose()
+
+
+def add_venue(name):
+    venue = fyyur.Venue(name=name, city="San Francisco", state="CA")
+    fyyur.db.session.add(venue)
+    fyyur.db.session.commit()
+    return venue
+
+
+def test_prune_then_insert_is_delivered(outbox):
+    seen = []
+    for i in range(3):
+        add_venue(f"Venue {i}")
+    while outbox.consume("index", seen.extend):
+        pass
+    position = outbox.position("index")
+    assert position == seen[-1]["id"]
+
+    outbox.prune()
+    add_venue("After prune")
+
+    events = outbox.pending("index")
+    assert [e["changes"]["name"] for e in events] == ["After prune"]
+    assert events[0]["id"] > position
+    assert outbox.status()["index"] == (position, 1)
+
+
+def test_prune_keeps_the_newest_event(outbox):
+    add_venue("Only one")
+    outbox.consume("index", lambda events: None)
+    assert outbox.prune() == 0
+    assert fyyur.OutboxEvent.query.count() == 1
+
+
+def test_deleted_venue_has_no_genre_event(outbox):
+    jazz = fyyur.Genre(name="Jazz")
+    venue = fyyur.Venue(name="Gone", city="San Francisco", state="CA", genres=[jazz])
+    fyyur.db.session.add(venue)
+    fyyur.db.session.commit()
+    outbox.consume("index", lambda events: None)
+
+    # both in one flush, the genre link goes with the venue
+    with fyyur.db.session.no_autoflush:
+        venue.genres = []
+        fyyur.db.session.delete(venue)
+    fyyur.db.session.commit()
+
+    assert [(e["entity"], e["op"]) for e in outbox.pending("index")] == [("venue", "delete")]
+
+
+def test_rolled_back_ids_dont_hold_up_sqlite_consumers(outbox):
+    for i in range(3):
+        add_venue(f"Venue {i}")
+    # as if the middle write had rolled back after taking its id
+    middle = fyyur.OutboxEvent.query.order_by(fyyur.OutboxEvent.id).all()[1]
+    fyyur.db.session.delete(middle)
+    fyyur.db.session.commit()
+    outbox.consume("index", lambda events: None, batch_size=1)
+
+    assert [e["changes"]["name"] for e in outbox.pending("index")] == ["Venue 2"]
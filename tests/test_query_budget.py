@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as fyyur  # noqa: E402
+import query_budget  # noqa: E402
+
+
+@pytest.fixture
+def seeded(tmp_path):
+    fyyur.app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'fyyur.db'}"
+    fyyur.app.config["TESTING"] = True
+    fyyur.admission.enabled = False
+    with fyyur.app.app_context():
+        fyyur.db.create_all()
+        query_budget.seed(fyyur)
+        fyyur.db.session.remove()
+    yield
+    with fyyur.app.app_context():
+        fyyur.db.session.remove()
+        fyyur.db.drop_all()
+        fyyur.db.get_engine().dispose()
+
+
+def test_every_route_within_budget(seeded):
+    measured = list(query_budget.measure(fyyur))
+    assert measured
+    over = [
+        (endpoint, url, len(statements), budget)
+        for endpoint, url, statements, budget in measured
+        if budget is None or len(statements) > budget
+    ]
+    assert over == []
+
+
+def test_shows_filters_match_seeded_rows(seeded):
+    response = fyyur.app.test_client().get("/shows", query_string=query_budget.QUERY_STRINGS["shows"])
+    assert b"The Venue" in response.data
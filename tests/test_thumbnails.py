@@ -0,0 +1,51 @@
+import os
+import sys
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as fyyur  # noqa: E402
+
+LINK = "https://images.unsplash.com/photo-1543900694-133f37abaaa5?w=400"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    fyyur.app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'fyyur.db'}"
+    fyyur.app.config["TESTING"] = True
+    fyyur.admission.enabled = False
+    monkeypatch.setattr(fyyur.image_store, "root", str(tmp_path / "images"))
+    fetched = []
+
+    def urlopen(url, *args, **kwargs):
+        fetched.append(url)
+        raise OSError("no network in tests")
+
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+    with fyyur.app.app_context():
+        fyyur.db.create_all()
+        fyyur.db.session.add(fyyur.Venue(name="The Musical Hop", city="San Francisco", state="CA", image_link=LINK))
+        fyyur.db.session.commit()
+        yield fyyur.app.test_client(), fetched
+        fyyur.db.session.remove()
+        fyyur.db.drop_all()
+        fyyur.db.get_engine().dispose()
+
+
+@pytest.mark.skipif(not fyyur.image_store.available, reason="needs Pillow")
+def test_unknown_src_is_not_fetched(client):
+    client, fetched = client
+    response = client.get("/thumbs/400.webp", query_string={"src": LINK + "&cache-buster=1"})
+    assert response.status_code == 404
+    assert fetched == []
+
+
+@pytest.mark.skipif(not fyyur.image_store.available, reason="needs Pillow")
+def test_image_link_is_fetched(client):
+    client, fetched = client
+    response = client.get("/thumbs/400.webp", query_string={"src": LINK})
+    # the fetch fails here, so the browser is sent to the original
+    assert response.status_code == 302
+    assert fetched == [LINK]